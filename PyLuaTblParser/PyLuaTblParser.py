@@ -1,6 +1,18 @@
-from copy import deepcopy
-from cStringIO import StringIO
-from string import printable
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from collections import Mapping, MutableMapping, Sequence, MutableSequence, OrderedDict, deque
+from itertools import chain, islice
+from math import copysign
+from mmap import mmap, ACCESS_READ
+from multiprocessing import Pool, cpu_count
+import gc
+import hashlib
+import marshal
+import os
+import tempfile
+import time
 
 _lua_keyword = ['and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for', 'function', 'if', \
                 'in', 'local', 'nil', 'not', 'or', 'repeat', 'return', 'then', 'true', 'until', \
@@ -8,448 +20,731 @@ _lua_keyword = ['and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for', '
 
 _escape_dict = {'a':'\a', 'b':'\b', 'f':'\f', 'n':'\n', 'r':'\r', 't':'\t', 'v':'\v', '\\':'\\', \
                 '"':'"', '\'':'\'', 'z':'\z', '\n':'\n'}
-_escape_dict_keys = _escape_dict.keys()
 
 _escape_dict_back = {'\a':'a', '\b':'b', '\f':'f', '\n':'n', '\r':'r', '\t':'t', '\v':'v', '\\':'\\'}
-_escape_dict_back_keys = _escape_dict_back.keys()
-
-_TOKEN_UNKNOWN = 0
-_TOKEN_NAME = 1
-_TOKEN_NUMBER = 2
-_TOKEN_STRING = 3
-_TOKEN_BOOLEAN = 4
-_TOKEN_NONE = 5
-_TOKEN_TABLE = 6
 
 _INDENT_STEP = 4
 
-class LuaParseError(Exception):
-    pass
-
-def _char2hex(c):
-    try:
-        return int(c, 16)
-    except ValueError:
-        return None
-
-def _char2int(c):
-    try:
-        return int(c)
-    except ValueError:
-        return None
-
-class _Token:
-    def getType(self):
-        return self._type
-
-class _TOKEN_UNKNOWN:
-    def __init__(self):
-        self._type = _TOKEN_UNKNOWN
-
-class _TokenName(_Token):
-    def __init__(self, strName):
-        self._type = _TOKEN_NAME
-        self._strName = strName
-
-    def getValue(self):
-        return self._strName
-
-class _TokenNumber(_Token):
-    def __init__(self, number):
-        self._type = _TOKEN_NUMBER
-        self._value = number
-
-    def getValue(self):
-        return self._value
-
-class _TokenString(_Token):
-    def __init__(self, pystr):
-        self._type = _TOKEN_STRING
-        self._value = pystr
-
-    def getValue(self):
-        return self._value
-
-class _TokenBoolean(_Token):
-    def __init__(self, value):
-        self._type = _TOKEN_BOOLEAN
-        self._value = value
-
-    def getValue(self):
-        return self._value
-
-class _TokenNone(_Token):
-    def __init__(self):
-        self._type = _TOKEN_NONE
-
-    def getValue(self):
-        return None
+# How many bytes dumpLuaTable() collects before writing them.
+_WRITE_BUFFER_SIZE = 64 * 1024
 
-class _TokenTable(_Token):
-    def __init__(self, t):
-        self._type = _TOKEN_TABLE
-        self._value = t
-
-    def getValue(self):
-        return self._value
-
-class _Text:
-    def __init__(self, text, lIndex, rIndex):
-        if(isinstance(text, _Text)):
-            self._text = text._text
-        else:
-            self._text = text
-        self._start = lIndex
-        self._end = rIndex
-        self._length = rIndex - lIndex
-        self._current = self._start
-
-    def trim(self):
-        index = self._current
-        while(index < self._length):
-            c = self._text[index]
-            if(c.isspace() is False):
-                break
-            index += 1 
-        self._current = index
+# Most tokens a field takes, separator included: [ key ] = value ,
+_FIELD_TOKENS = 6
 
-    def trimComments(self):
-        if(self.isCommentNext() == False):
-            return
+class LuaParseError(Exception):
+    pass
 
-        self.move(2)
-        (islongstring, longstring) = self.tryNextLongString()
-        if(islongstring):
+#----------lexer---------------------------
+# One match per token. Whitespace and comments in front of a token are folded
+# into its match, so findall() returns the list of token strings in a single
+# pass over the text. The last token is always the empty string at the end of
+# the text. Malformed input still produces a token (an unfinished string is
+# just its quote, an unfinished long string or long comment runs to the end
+# of the text), and the parser reports it only if it actually reaches it.
+_token_pattern_template = r'''
+    (?:[ \t\n\r\f\v]+ | --%(longBracket)s | --(?!\[=*\[)[^\n]*)*
+    (   [{}=,;\]]
+      | %(longBracket)s
+      | \[=*\[.*
+      | \[=*
+      | "[^"\\]*(?:\\.[^"\\]*)*"
+      | '[^'\\]*(?:\\.[^'\\]*)*'
+      | [A-Za-z_]\w*
+      | [+-]?\.?\d[\w.]*(?:(?<=[eEpP])[+-][\w.]*)?
+      | [+-][A-Za-z_]\w*
+      | --\[=*\[.*
+      | [^ \t\n\r\f\v]
+      | \Z
+    )'''
+
+# Matching a long bracket of any level needs a backreference, i.e. extra
+# groups, and then findall() returns a tuple per token. The usual levels are
+# spelled out instead; texts with deeper brackets use the general pattern.
+_LONG_BRACKET_LEVELS = 8
+_token_pattern = re.compile(_token_pattern_template % {'longBracket': '(?:' + \
+    '|'.join([r'\[%s\[.*?\]%s\]' % ('=' * i, '=' * i) for i in xrange(_LONG_BRACKET_LEVELS)]) + ')'}, \
+    re.S | re.X)
+_deep_token_pattern = re.compile((_token_pattern_template % {'longBracket': r'\[(=*)\[.*?\]\%d\]'}) \
+    % (1, 3), re.S | re.X)
+_deep_bracket_pattern = re.compile(r'\[={%d}' % _LONG_BRACKET_LEVELS)
+_newline_pattern = re.compile(r'\n')
+_blank_pattern = re.compile(r'[ \t\n\r\f\v]*\Z')
+
+_number_pattern = re.compile(r'''[+-]?(?:
+        (\d+)
+      | (0[xX][0-9a-fA-F]+)
+      | (0[xX](?:[0-9a-fA-F]+\.?[0-9a-fA-F]*|\.[0-9a-fA-F]+)(?:[pP][+-]?\d+)?)
+      | ((?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|[iI][nN][fF](?:[iI][nN][iI][tT][yY])?|[nN][aA][nN])
+    )\Z''', re.X)
+
+_NUMBER_INT = 1
+_NUMBER_HEX_INT = 2
+_NUMBER_HEX_FLOAT = 3
+_NUMBER_FLOAT = 4
+
+_escape_pattern = re.compile(r'''\\(?:([abfnrtvz\\"'\n])|x([0-9a-fA-F]{2})|(\d{1,3})|(.))''', re.S)
+
+_CHAR_STRING = 1
+_CHAR_NUMBER = 2
+_CHAR_NAME = 3
+_CHAR_BRACKET = 4
+
+_char_kinds = {'"':_CHAR_STRING, '\'':_CHAR_STRING, '[':_CHAR_BRACKET}
+for c in '0123456789.+-':
+    _char_kinds[c] = _CHAR_NUMBER
+for c in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_':
+    _char_kinds[c] = _CHAR_NAME
+
+_name_values = {'nil':None, 'true':True, 'false':False}
+_special_floats = ['inf', 'infinity', 'nan']
+_reserved_names = frozenset(_lua_keyword)
+
+# Skips to the next brace outside strings, long strings and comments. Every
+# character other than a brace is consumed by one of the branches (a quote or
+# bracket that opens nothing is taken on its own, as the lexer does), so the
+# loop always stops at a brace or at the end without backtracking.
+_skip_pattern = re.compile(r'''
+    (?:[^{}"'\[-]+
+      | "[^"\\]*(?:\\.[^"\\]*)*" | "
+      | '[^'\\]*(?:\\.[^'\\]*)*' | '
+      | \[(=*)\[.*?\]\1\] | \[
+      | --\[(=*)\[.*?\]\2\] | --(?!\[=*\[)[^\n]* | --\[=*\[ | -
+    )*
+    (?P<brace>[{}]|\Z)''', re.S | re.X)
+
+# The lexer runs on str and on any buffer that re returns str slices of (an
+# mmap or a buffer()), using offsets into it, so a big text is never copied.
+_CHUNK_SIZE = 64 * 1024
+
+def _tokenize(s, start = 0, end = None):
+    ''' Split s[start:end] into a list of token strings ending with the empty
+    token.
+    '''
+    if(end is None):
+        end = len(s)
+    if(_deep_bracket_pattern.search(s, start, end) is None):
+        return _token_pattern.findall(s, start, end)
+    return [match[1] for match in _deep_token_pattern.findall(s, start, end)]
+
+def _iterTokenWindows(s, start, end, chunkSize = _CHUNK_SIZE):
+    ''' Like _tokenize(s, start, end), but yields the tokens in lists covering
+    about chunkSize characters each, only the last one ending with the empty
+    token.
+    '''
+    windowSize = chunkSize
+    while True:
+        if(end - start <= windowSize):
+            yield _tokenize(s, start, end)
             return
-
-        c = self.nextChar()
-        while c is not None:
-            self.moveNext()
-            if c == '\n':
-                break
-            c = self.nextChar()
-    
-    def trimAll(self):
-       self.trim()
-       while self.isCommentNext() is True:
-           self.trimComments()
-           self.trim()       
-
-    def isCommentNext(self):
-        oldCurrent = self._current
-        c = self.nextChar()
-        if(c is not '-'):
-            return False
-        self.moveNext()
-        c = self.nextChar()
-        if(c is not '-'):
-            self._current = oldCurrent
-            return False
-        self._current = oldCurrent
-        return True
-
-    def nextChar(self):
-        if(self._current >= self._end):
-            return None
-        result = self._text[self._current]
-        return result
-
-    def nextTokenText(self):
-        token = self.tryNextTokenText()
-        self._current = token._end
-        return token
-
-    def tryNextTokenText(self):
-        self.trimAll()
-        start = self._current
-        index = self._current
-        while(index < self._length):
-            c = self._text[index]
-            if(c.isspace()):
-                break
-            index += 1 
-        end = index
-        return _Text(self._text, start, end)
-
-    def nextTokenChar(self):
-        self.trimAll()
-        return self._text[self._current]
-
-    def nextTokenBefore(self, clist):
-        self.trimAll()
-
-        (islongstring, longstring) = self.tryNextLongString()
-        if islongstring:
-            return longstring
-
-        c = self.nextTokenChar()
-        if(c == '\'' or c == '\"'):
-            read_string = self.nextString()
-            token = _TokenString(read_string)
-            return token
-            
-        start = self._current
-        while True:
-            c = self.nextChar()
-            if(c is None):
-                raise LuaParseError('Expecting ' + str(clist) +', but reached end of the text.')
-            if c.isspace() or c in clist or self.isCommentNext():
-                break
-            self.moveNext()
-
-        end = self._current 
-        text = _Text(self, start, end)
-        return _Text._parseTokenFromText(text)
-
-    def nextString(self):
-        self.trimAll()
-        start = self._current
-        index = self._current + 1
-        while(index < self._length):
-            if(self._text[index] == '\\'):
-                index += 2
-            else:
-                if(self._text[index] == self._text[start]):
-                    index += 1
-                    break
-                index += 1
+        newline = _newline_pattern.search(s, start + windowSize, start + 2 * windowSize)
+        if(newline is None):
+            (tokens, start) = _lexWindow(s, start, start + windowSize)
         else:
-            raise LuaParseError("End of string not found.")
-        end = index
-        self._current = end
-        return self._parseString(self._text[start:end])
-
-    def tryNextLongString(self):
-        oldCurrent = self._current
-        self.trimAll()
-        if(self.nextChar() is not '['):
-            self._current = oldCurrent
-            return (False, None)
-        self.moveNext()
-        c = self.nextChar()
-        if(c is not '[' and c is not '='):
-            self._current = oldCurrent
-            return (False, None)
-
-        level = self.computeLongStringLevel()                    
-        textBegin = self._current
-        textEnd = textBegin
-        while self.isEndOfLongString(level) == False:
-            textEnd += 1
-            self.moveNext()
-        return (True, _TokenString(self._text[textBegin:textEnd]))
-           
-    def computeLongStringLevel(self):
-        level = 0
-        while True:
-            c = self.nextChar()
-            self.moveNext()
-            if(c is '['):
+            (tokens, start) = _lexWindow(s, start, newline.start(), True)
+        if(len(tokens) == 0):
+            # Nothing complete yet: take more at once so that a huge token is
+            # not lexed again for every chunk.
+            windowSize *= 2
+            continue
+        windowSize = chunkSize
+        yield tokens
+
+def _lexWindow(s, start, end, atNewline = False):
+    ''' Returns the tokens of s[start:end] that the text after end cannot
+    change, and the offset where lexing has to go on. atNewline tells that
+    s[end] is a newline.
+    '''
+    # Everything from an unfinished token on may be lexed differently once
+    # the rest is there: from a lone quote, or from the last token when it
+    # is an unfinished long string or comment, which runs to the end. That
+    # tail is left for the next window. A newline ends any other token, so
+    # then the window can be cut at end. Otherwise a token cut off at end is
+    # lexed as at most two fragments glued to each other ('+.' of '+.5'),
+    # and the matches around the cut are looked at to find where it starts.
+    if(_deep_bracket_pattern.search(s, start, end) is None):
+        (pattern, group) = (_token_pattern, 1)
+        tokens = pattern.findall(s, start, end)
+    else:
+        (pattern, group) = (_deep_token_pattern, 2)
+        tokens = [match[1] for match in pattern.findall(s, start, end)]
+
+    last = tokens.index('')
+    count = last
+    for quote in ('"', '\''):
+        if(quote in tokens):
+            count = min(count, tokens.index(quote))
+    if(count > 0 and _isUnfinished(tokens[count - 1])):
+        count -= 1
+    if(atNewline and count == last):
+        del tokens[last:]
+        return (tokens, end)
+
+    matches = list(islice(pattern.finditer(s, start, end), max(0, count - 2), count + 1))
+    cut = matches[-1].start()
+    if(len(tokens[count]) == 0 and matches[-1].start(group) == cut):
+        for match in reversed(matches[:-1]):
+            count -= 1
+            cut = match.start()
+            if(match.start(group) != cut):
                 break
-            if(c is not '='):
-                raise LuaParseError("Expecting '=' or '[' before." + c)
-            level += 1
-        return level
-
-    def isEndOfLongString(self, level):
-        oldCurrent = self._current
-        c = self.nextChar()
-        if c is not ']':
-            return False
-        
-        self.moveNext()
-        c = self.nextChar()
-        if c is not ']' and c is not '=':
-            self._current = oldCurrent
-            return False
-
-        endLevel = 0
-        while True:
-            c = self.nextChar()
-            self.moveNext()
-            if(c is ']'):
+    del tokens[count:]
+    return (tokens, cut)
+
+def _isUnfinished(token):
+    # Tokens the lexer produces for a string, long bracket or comment whose end
+    # was not found. More text may complete them.
+    c = token[:1]
+    return (c == '"' or c == '\'') and len(token) == 1 or \
+        c == '[' and len(token) > 1 and not _isClosed(token) or \
+        token.startswith('--[')
+
+def _viewReader(view):
+    # A read() function over a memoryview; re cannot read one directly.
+    offset = [0]
+    def read(size):
+        chunk = view[offset[0]:offset[0] + size].tobytes()
+        offset[0] += len(chunk)
+        return chunk
+    return read
+
+def _outerTokens(s):
+    ''' Like _tokenize(s), but only the tokens of the outermost table are
+    produced and each of its subtables is reduced to its '{' token. Returns the
+    tokens and a dict mapping the index of each such token to a _LazyTable.
+    '''
+    if(_deep_bracket_pattern.search(s) is None):
+        (match, group) = (_token_pattern.match, 1)
+    else:
+        (match, group) = (_deep_token_pattern.match, 2)
+    tokens = []
+    tables = {}
+    pos = 0
+    while True:
+        tokenMatch = match(s, pos)
+        token = tokenMatch.group(group)
+        pos = tokenMatch.end()
+        if(len(token) == 0):
+            break
+        if(len(tokens) == 0):
+            if(token != '{'):
+                tokens.append(token)
                 break
-            if(c is not '='):
-                self._current = oldCurrent
-                return False
-            endLevel += 1
-
-        if level == endLevel:
-            return True
-        self._current = oldCurrent
-        return False
-
-
-    def moveNext(self):
-        if(self._current >= self._end):
-            raise Exception('Already reaches the end of the text!')
-        self._current += 1
-
-    def move(self, step):
-        self._current += step
-
-    def length(self):
-        return self._length
-
-    def __str__(self):
-        return self._text[self._start:self._end]
-
-    @staticmethod
-    def _parseTokenFromText(text):
-        tokenStr = str(text)
-        if(len(tokenStr) == 0):
-            return None
-        if(tokenStr == 'nil'):
-            return _TokenNone()
-        if(tokenStr == 'true'):
-            return _TokenBoolean(True)
-        if(tokenStr == 'false'):
-            return _TokenBoolean(False)
-
-        (isNumber, number) = _Text._tryParseNumber(tokenStr)
-        if(isNumber):
-            return _TokenNumber(number)
-        
-        if _Text._isLuaName(tokenStr):
-            return _TokenName(tokenStr)
-
-        message =  'Unrecognized token \'' + tokenStr + '\''
-        raise LuaParseError(message)
-
-    @staticmethod
-    def _tryParseNumber(s):
-        if(len(s) > 2 and s[0] is '0' and s[1] in ['x', 'X']):
-            try:
-                number = int(s, 16)
-                return(True, number)
-            except Exception:
-                try:
-                    number = float.fromhex(s)
-                    return(True, number)
-                except Exception:
-                    pass
-        try:
-            number = int(s)
-            return(True, number)
-        except Exception:
-            try:
-                number = float(s)
-                return(True, number)
-            except Exception:
-                return (False, None)
-
-    @staticmethod
-    def _parseString(s):
-        chars = []
-        length = len(s) - 1
-        index = 0
-        while index < length - 1:
-            index += 1
-            c = s[index]
-            if c != '\\':
-                chars.append(c)
-                continue
-            index += 1
-            c = s[index]
-            if c in _escape_dict_keys:
-                chars.append(_escape_dict[c])
-            elif c is 'z':
-                while c.isspace() is False:
-                    index += 1
-                    c = s[index]
-                index -= 1
-            elif c is 'x':
-                if(index + 2 >= length):
-                    raise LuaParseError("There must be at least two hex numbers after '\\x'!")
-                hex1 = _char2hex(s[index + 1])
-                hex2 = _char2hex(s[index + 2])
-                if(hex1 is None or hex2 is None):
-                    raise LuaParseError("There must be at least two hex numbers after '\\x'!")
-                chars.append(chr(hex1 * 16 + hex2))
-                index += 2
-            elif c.isdigit():
-                digit_count = 0
-                while digit_count < 3:
-                    digit_count += 1
-                    index_2 = index + digit_count
-                    if(index_2 >= length or not s[index_2].isdigit()):
-                        break
-                asciiCode = 0
-                for i in range(digit_count):
-                    asciiCode *= 10
-                    asciiCode += _char2int(s[index + i])
-                chars.append(chr(asciiCode))
-                index += digit_count - 1
-            else:
-                chars.append(c)
-        return ''.join(chars)
-
-    @staticmethod
-    def _isLuaName(s):
-        if s[0].isdigit():
-            return False
-        for c in s:
-            if(c.isalpha() == False and c != '_'):
-                return False
-        if s in _lua_keyword:
-            return False
-        return True
+        elif(token == '{'):
+            start = tokenMatch.start(group)
+            pos = _skipTable(s, pos)
+            tables[len(tokens)] = _LazyTable(s, start, pos)
+        elif(token == '}'):
+            tokens.append(token)
+            break
+        tokens.append(token)
+    tokens.append('')
+    return (tokens, tables)
+
+def _skipTable(s, pos):
+    ''' Returns the offset right after the '}' that closes the table whose '{'
+    ends at pos.
+    '''
+    match = _skip_pattern.match
+    depth = 1
+    while True:
+        braceMatch = match(s, pos)
+        brace = braceMatch.group('brace')
+        pos = braceMatch.end()
+        if(brace == '{'):
+            depth += 1
+        elif(brace == '}'):
+            depth -= 1
+            if(depth == 0):
+                return pos
+        else:
+            raise LuaParseError(_unexpectedMessage('Expecting \'}\' when parsing table.', brace))
+
+def _parseValue(token):
+    ''' Convert a value token to the Python object it stands for.
+    '''
+    kind = _char_kinds.get(token[:1])
+    if(kind == _CHAR_NUMBER):
+        return _parseNumber(token)
+    elif(kind == _CHAR_STRING):
+        return _parseString(token)
+    elif(kind == _CHAR_NAME):
+        if(token in _name_values):
+            return _name_values[token]
+        if(token.lower() in _special_floats):
+            return float(token)
+        if(token in _reserved_names):
+            raise LuaParseError('Unrecognized token \'' + token + '\'')
+        raise LuaParseError('Lua name cannot appear as value! At \'' + token + '\'')
+    elif(kind == _CHAR_BRACKET and _isClosed(token)):
+        level = token.index('[', 1) + 1
+        return token[level:-level]
+    raise LuaParseError(_unexpectedMessage('Expecting value.', token))
+
+def _parseNumber(token):
+    if(token.isdigit()):
+        return int(token)
+    match = _number_pattern.match(token)
+    if(match is None):
+        if(token.startswith('--[')):
+            raise LuaParseError('End of long comment not found.')
+        raise LuaParseError('Unrecognized token \'' + token + '\'')
+    kind = match.lastindex
+    if(kind == _NUMBER_INT):
+        return int(token)
+    elif(kind == _NUMBER_FLOAT):
+        return float(token)
+    elif(kind == _NUMBER_HEX_INT):
+        return int(token, 16)
+    return float.fromhex(token)
+
+def _parseString(token):
+    if(len(token) < 2):
+        raise LuaParseError('End of string not found.')
+    s = token[1:-1]
+    if('\\' in s):
+        return _escape_pattern.sub(_unescape, s)
+    return s
+
+def _unescape(match):
+    c = match.group(1)
+    if(c is not None):
+        return _escape_dict[c]
+    hexCode = match.group(2)
+    if(hexCode is not None):
+        return chr(int(hexCode, 16))
+    digits = match.group(3)
+    if(digits is not None):
+        code = int(digits)
+        if(code > 255):
+            raise LuaParseError('Decimal escape too large: \'\\' + digits + '\'')
+        return chr(code)
+    c = match.group(4)
+    if(c == 'x'):
+        raise LuaParseError("There must be at least two hex numbers after '\\x'!")
+    return c
+
+def _isClosed(token):
+    # Whether a token starting with a long bracket also ends with its closing
+    # bracket.
+    level = token.find('[', 1) + 1
+    return level > 1 and len(token) >= 2 * level and token.endswith(']' + token[1:level - 1] + ']')
+
+def _unexpectedMessage(message, token):
+    if(len(token) == 0):
+        return message + ' But reached end of the text.'
+    if(token[0] == '[' and len(token) > 1):
+        return 'End of long string not found.'
+    return message + ' Got \'' + token + '\''
 
 class PyLuaTblParser:
     #----------constructor--------------------
     def __init__(self):
         self._dict = {}
+        self._shared = False
+        self._ownTables = None
+        self._copies = None
+        self._text = None
+        self._textSpan = None
+        self._spans = None
+        self._feeding = None
+        self._stats = None
+        self.stats = None
+        self._arrays = False
+        self._strings = None
+        self._luaTables = False
+        self._tablePool = None
+        self._sharesTables = False
         pass
 
     #----------public functions---------------
-    def load(self, s):
-        ''' Load lua table s. 
+    def load(self, s, lazy = False, cache = None, editable = False, select = None, arrays = False, \
+        intern_strings = False, lua_tables = False, dedup = False, workers = None):
+        ''' Load lua table s, which may also be a bytearray, memoryview, buffer
+        or mmap. The text is read in place, a window at a time.
+        If lazy is True, only the fields of the outermost table are read and
+        its subtables are parsed the first time they are looked up, so the
+        first lookup costs the size of that subtable rather than of s.
+        If cache is a ParseCache, the table is taken from it when the same
+        text was loaded before, and stored in it otherwise. Lazy loads do not
+        use the cache.
+        If editable is True, s is kept so that edit() can be applied to it.
+        If select is a list of key paths, only the fields they lead to are
+        loaded, along with the tables on the way to them, and the rest of s is
+        skipped without being parsed. A path is a list of keys or a string of
+        keys separated by dots, where digits stand for a number, '*' stands
+        for any key, and list items are counted from 0: 'meta.version' or
+        'items.*.id'. A list keeps only its selected items, in order. Such a
+        load can be neither lazy, editable nor parallel, and is not cached.
+        Grammar errors in the skipped parts may go unnoticed.
+        If arrays is True, subtables that are lists of plain decimal numbers,
+        all integers or all with a fraction or exponent, are loaded as
+        array.array of typecode 'l' or 'd', which takes a fraction of the
+        memory.
+        If intern_strings is True, names used as keys and strings up to 32
+        characters long are stored once, however often they occur, and a
+        StringPool shares them with other loads as well. Interned keys also
+        make lookups with the same key written in the program faster.
+        If lua_tables is True, tables are loaded as LuaTable, which keeps the
+        values at keys 1 to n in a list and the other fields in a dict, as
+        Lua does, instead of as a list or a dict.
+        If dedup is True, subtables equal to one loaded before, field by field
+        and type by type, are not kept apart but share that one, and [] hands
+        out subtables as copy-on-write stand-ins, as after snapshot(), so a
+        change copies the tables on its way only. LuaTables are not shared,
+        so dedup cannot be combined with lua_tables.
+        Loads with arrays, intern_strings, lua_tables or dedup do not use the
+        cache, and cannot be lazy, editable, selective or parallel.
+        If workers is given, the outermost table is first scanned for its
+        fields, and its subtables are parsed by a pool of that many processes
+        (in this process for one worker) in runs of consecutive ones. This
+        pays off for a big table of many subtables; the fields of one
+        subtable are not split further. Such a load cannot be lazy.
         No return value.
-        Throws LuaParseError when the table has grammar errors.    
+        Throws LuaParseError when the table has grammar errors. In lazy mode
+        errors inside a subtable are thrown when it is parsed. Throws
+        ValueError when workers is less than 1 or the arguments cannot be
+        combined.
         '''
-        text = s.strip()
-        if(len(text) == 0):
+        _checkLoadArguments(lazy, editable, select, arrays, intern_strings, lua_tables, dedup, \
+            workers)
+        if(editable and not isinstance(s, basestring)):
+            # edit() cuts and joins the text, and it is kept after load()
+            # returns, so it is copied into a str.
+            s = s.tobytes() if isinstance(s, memoryview) else str(buffer(s))
+        if(select is not None):
+            if(isinstance(s, memoryview)):
+                s = s.tobytes()
+            elif(not isinstance(s, (basestring, buffer, mmap))):
+                s = buffer(s)
+            if(not self._isBlank(s)):
+                self._setTable(_projectText(s, _selectTree(select)))
             return
-        self._text = _Text(text, 0, len(text))
-        self._dict = self._nextTable().getValue()
+        if(cache is not None and not lazy and not arrays and not lua_tables and not dedup and \
+            (intern_strings is False or intern_strings is None)):
+            if(isinstance(s, unicode)):
+                # A unicode text loads unicode strings, so it is not taken for
+                # the equal str text.
+                name = 'u' + hashlib.sha1(s.encode('utf-8')).hexdigest()
+            else:
+                name = hashlib.sha1(s).hexdigest()
+            if(not self._loadCached(cache, name, None)):
+                previous = self._dict
+                self.load(s, workers = workers)
+                if(self._dict is not previous):
+                    cache._put(name, None, self._dict)
+            if(editable):
+                self._text = s
+            return
+        if(workers is not None and not lazy):
+            if(isinstance(s, memoryview)):
+                s = s.tobytes()
+            elif(not isinstance(s, (basestring, buffer, mmap))):
+                s = buffer(s)
+            self._loadParallel(s, workers)
+            if(editable):
+                self._text = s
+            return
+        windows = None
+        if(isinstance(s, memoryview)):
+            # Copied a window at a time, or at once for subtables to refer to.
+            if(lazy):
+                s = s.tobytes()
+            else:
+                windows = _iterTokenChunks(_viewReader(s), _CHUNK_SIZE)
+        elif(not isinstance(s, (basestring, buffer, mmap))):
+            s = buffer(s)
+        if(lazy):
+            (tokens, tables) = _outerTokens(s)
+        else:
+            if(windows is None):
+                windows = _iterTokenWindows(s, 0, len(s))
+            if(self._stats is not None):
+                windows = self._stats._watch(windows)
+            tokens = windows.next()
+        if(len(tokens[0]) == 0 and self._isBlank(s)):
+            return
+        self._tokens = tokens
+        self._windows = windows
+        if(lazy):
+            self._tables = tables
+        self._pos = 0
+        self._arrays = arrays
+        self._luaTables = lua_tables
+        if(dedup):
+            self._tablePool = {}
+        if(intern_strings is True):
+            self._strings = StringPool()._strings
+        elif(isinstance(intern_strings, StringPool)):
+            self._strings = intern_strings._strings
+        try:
+            if(lazy):
+                self._setTable(self._nextLazyTable())
+            else:
+                self._setTable(self._nextTable())
+                if(self._tablePool is not None):
+                    self._markShared()
+            if(editable):
+                self._text = s
+        finally:
+            self._tokens = None
+            self._windows = None
+            self._tables = None
+            self._arrays = False
+            self._strings = None
+            self._luaTables = False
+            self._tablePool = None
+
+    def instrument(self, enabled = True, callback = None):
+        ''' Turn instrumentation of load(), dump(), loadDict() and dumpDict()
+        on or off. While it is on, each call leaves a ParserStats in the stats
+        attribute and passes it to callback, if given. Turning it off costs
+        nothing: the calls go straight to the methods again.
+        No return value.
+        '''
+        for name in _INSTRUMENTED:
+            if(enabled):
+                setattr(self, name, _instrumented(self, name, callback))
+            elif(name in self.__dict__):
+                delattr(self, name)
+        self.stats = None
+
+    def feed(self, data):
+        ''' Go on loading a lua table whose text arrives in pieces, as from a
+        socket: data is the next piece, a string or anything load() accepts.
+        A piece may end anywhere, even inside a string, long bracket or
+        comment. What is complete is parsed right away, so that close() has
+        little left to do. Text after the table is ignored.
+        The content is only replaced when close() is called.
+        No return value.
+        Throws LuaParseError as soon as the text fed so far has grammar errors,
+        after which feeding starts over.
+        '''
+        if(isinstance(data, memoryview)):
+            data = data.tobytes()
+        elif(not isinstance(data, basestring)):
+            data = str(buffer(data))
+        if(self._feeding is None):
+            self._feeding = ('', [], None, None, 0)
+        (text, tokens, resume, table, lexAt) = self._feeding
+        if(table is not None):
+            return
+        # Like _iterTokenChunks(), the tail that may still change is lexed
+        # again together with the next piece. When a token is so long that
+        # nothing could be lexed, as in a long string, the text is only lexed
+        # again once it has doubled, so that it is not lexed once per piece.
+        text += data
+        if(len(text) < lexAt):
+            self._feeding = (text, tokens, resume, None, lexAt)
+            return
+        newline = text.rfind('\n')
+        if(newline > 0):
+            (newTokens, cut) = _lexWindow(text, 0, newline, True)
+        else:
+            (newTokens, cut) = _lexWindow(text, 0, len(text))
+        lexAt = 2 * (len(text) - cut) if len(newTokens) == 0 else 0
+        self._feeding = (text[cut:], tokens + newTokens, resume, None, lexAt)
+        self._feedTokens()
+
+    def close(self):
+        ''' Finish loading the lua table fed to feed() and make it the content
+        of the table. Nothing changes when only whitespace and comments were
+        fed.
+        No return value.
+        Throws LuaParseError when the table has grammar errors or the text
+        ends before it does.
+        '''
+        feeding = self._feeding
+        if(feeding is None):
+            return
+        (text, tokens, resume, table, _) = feeding
+        if(table is None):
+            self._feeding = ('', tokens + _tokenize(text), resume, None, 0)
+            self._feedTokens()
+            table = self._feeding[3]
+            if(table is None):
+                self._feeding = None
+                return
+        self._feeding = None
+        self._setTable(table)
 
     def dump(self):
        ''' Dump a string according to the content of the lua table.
        Returns the dumped string.
        '''
-       self._indent = 0 
-       output = StringIO()
-       self._dumpItem(output, self._dict)
-       return output.getvalue()
-
-    def loadLuaTable(self, f):
-        '''Read Lua table from file f.
+       chunks = _DumpBuffer()
+       self._dumpItem(chunks, self._dict, '\n')
+       return ''.join(chunks)
+
+    def loadLuaTable(self, f, lazy = False, cache = None, select = None, arrays = False, \
+        intern_strings = False, lua_tables = False, dedup = False, workers = None):
+        '''Read Lua table from file f. See load() for lazy, select, arrays,
+        intern_strings, lua_tables, dedup and workers.
+        The file is memory-mapped when possible, so it is not read into memory
+        as a whole. Lazy loads read it whole instead, as their subtables are
+        parsed later, when the file may have changed.
+        If cache is a ParseCache, the table is taken from it when f has not
+        changed since it was loaded last, which costs a stat() call, and
+        stored in it otherwise. Lazy loads do not use the cache.
         No return value.
-        Throws LuaParseError when the table has grammar errors.    
+        Throws LuaParseError when the table has grammar errors, and ValueError
+        as load() does.
         '''
-        infile = open(f)
-        self.load(infile.read())
-        infile.close()
+        _checkLoadArguments(lazy, False, select, arrays, intern_strings, lua_tables, dedup, \
+            workers)
+        if(cache is not None and not lazy and select is None and not arrays and not lua_tables and \
+            not dedup and (intern_strings is False or intern_strings is None)):
+            info = os.stat(f)
+            (name, stamp) = (os.path.abspath(f), (info.st_mtime, info.st_size))
+            if(not self._loadCached(cache, name, stamp)):
+                previous = self._dict
+                self.loadLuaTable(f, workers = workers)
+                if(self._dict is not previous):
+                    cache._put(name, stamp, self._dict)
+            return
+        infile = open(f, 'rb')
+        try:
+            if(lazy):
+                # A mapping would show later changes of the file to the
+                # subtables, or fault once it is truncated.
+                text = infile.read()
+            else:
+                try:
+                    text = mmap(infile.fileno(), 0, access = ACCESS_READ)
+                except (ValueError, EnvironmentError):
+                    # Empty files cannot be mapped, nor can pipes and the like.
+                    text = infile.read()
+        finally:
+            infile.close()
+        try:
+            self.load(text, lazy, select = select, arrays = arrays, intern_strings = intern_strings, \
+                lua_tables = lua_tables, dedup = dedup, workers = workers)
+        finally:
+            if(isinstance(text, mmap)):
+                text.close()
 
-    def dumpLuaTable(self, f):
+    def dumpLuaTable(self, f, buffer_size = _WRITE_BUFFER_SIZE):
         ''' Dump the content of the table to the file f in Lua table format.
+        f is a file name or an object with a write() method. The text is
+        written as it is produced, about buffer_size bytes at a time.
         If the file already exists, rewrite it.
+        Returns the number of bytes written.
         Throws IOError when failed to write file.
         '''
+        if(not isinstance(f, basestring)):
+            return self._dumpTo(f.write, buffer_size)
         outfile = open(f, 'w')
-        outfile.write(self.dump())
-        outfile.close()
-
-    def loadDict(self, d):
+        try:
+            return self._dumpTo(outfile.write, buffer_size)
+        finally:
+            outfile.close()
+
+    def dumpBinary(self, f = None):
+        ''' Dump the content of the table in the binary format loadBinary()
+        reads, to the file f, a file name or an object with a write() method.
+        Returns the encoded table as a str if f is None, and the number of
+        bytes written otherwise.
+        Throws IOError when failed to write file, and ValueError when tables
+        are nested too deeply for the format.
+        '''
+        data = _BINARY_HEADER + marshal.dumps(_internedCopy(self._dict), _MARSHAL_VERSION)
+        if(f is None):
+            return data
+        if(not isinstance(f, basestring)):
+            f.write(data)
+            return len(data)
+        outfile = open(f, 'wb')
+        try:
+            outfile.write(data)
+        finally:
+            outfile.close()
+        return len(data)
+
+    def loadBinary(self, f, trusted = False):
+        ''' Load a table written by dumpBinary(). f is a file name, an object
+        with a read() method, or the encoded table itself as a str, bytearray,
+        memoryview, buffer or mmap.
+        Every key and value loaded is checked to be one dumpBinary() writes,
+        which takes longer than decoding them: it is the difference between
+        loading about five and about twenty times faster than load() reads
+        the same table as text. Pass trusted = True for input this class wrote
+        itself to skip the check; anything else may then leave the class
+        holding values it cannot dump.
+        No return value.
+        Throws LuaParseError when f does not hold a table in this format, and
+        IOError when failed to read file.
+        '''
+        if(isinstance(f, basestring) and not f.startswith(_BINARY_MAGIC)):
+            infile = open(f, 'rb')
+            try:
+                data = infile.read()
+            finally:
+                infile.close()
+        elif(hasattr(f, 'read')):
+            data = f.read()
+        elif(isinstance(f, memoryview)):
+            data = f.tobytes()
+        else:
+            data = f
+        header = len(_BINARY_HEADER)
+        if(data[:len(_BINARY_MAGIC)] != _BINARY_MAGIC):
+            raise LuaParseError('Not a binary Lua table.')
+        if(data[:header] != _BINARY_HEADER):
+            raise LuaParseError('Unsupported binary Lua table version.')
+        # The tables loaded hold no reference cycles, so there is nothing for
+        # the garbage collector to find while millions of them are created.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            table = marshal.loads(buffer(data, header))
+            broken = not trusted and not _isBinaryTable(table)
+        except (EOFError, ValueError, TypeError):
+            broken = True
+        finally:
+            if(enabled):
+                gc.enable()
+        if(broken):
+            raise LuaParseError('Broken binary Lua table.')
+        self._setTable(table)
+
+    def loadDict(self, d, dedup = False):
         ''' Read contents of a dict d an save it into the class.
         Only handle keys with types as number and string.
+        d may also be a list, like the tables load() returns lists for.
+        See load() for dedup.
         '''
-        self._dict = self._loadDict(d)
+        if(isinstance(d, _TableView) or isinstance(d, _ListView)):
+            d = d._table
+        if(isinstance(d, list)):
+            self._setTable(self._loadList(d))
+        else:
+            self._setTable(self._loadDict(d))
+        if(dedup):
+            _dedupTables(self._dict, {})
+            self._markShared()
 
     def dumpDict(self):
         '''Returns a dict containing contents of the class.
         '''
-        return deepcopy(self._dict)
+        return self._loadValue(self._dict)
+
+    def snapshot(self):
+        '''Returns a read-only view of the contents of the class, a Mapping for
+        a dict and a Sequence for a list, with its tables as views as well.
+        Later changes to the class do not show in it. Taking a snapshot costs
+        O(1): nothing is copied until the class is changed, and then only the
+        tables on the way to the change are. Until the table is loaded again,
+        [] hands out subtables as copy-on-write stand-ins for them, a
+        MutableMapping for a dict and a MutableSequence for a list.
+        '''
+        self._shared = True
+        # The tables owned so far are shared from now on. The dict itself is
+        # kept, as proxies tell a table loaded again by it.
+        if(self._ownTables is None):
+            self._ownTables = {}
+            self._copies = {}
+        else:
+            self._ownTables.clear()
+        return _view(self._dict)
 
     def update(self, d):
         '''Update content of the lua table according to dict d like dict.update()
@@ -457,294 +752,870 @@ class PyLuaTblParser:
         for key, value in d.iteritems():
             self[key] = value
 
+    def merge(self, d, deep = True, adopt = False):
+        ''' Merge d, a dict or a snapshot() or another PyLuaTblParser, into
+        the table. Like update(), fields of d replace those of the table, but
+        a field set to None removes the field, and if deep is True, a dict in
+        d is merged the same way into the dict or LuaTable the table has
+        under its key instead of replacing it. Both are walked together once,
+        so the cost grows with the size of d, not of the table.
+        The values taken from d are copied unless adopt is True, in which
+        case they are stored as they are; d must then be left alone
+        afterwards, and hold no None values other than those meant to remove
+        fields.
+        No return value.
+        '''
+        if(isinstance(d, PyLuaTblParser)):
+            d = d._dict
+        elif(isinstance(d, _TableView)):
+            d = d._table
+        stack = []
+        for key, value in d.iteritems():
+            if(not self._isKey(key)):
+                continue
+            if(value is None):
+                self._unshare()
+                if(isinstance(self._dict, list)):
+                    self._dict[key] = None
+                elif(key in self._dict):
+                    del self._dict[key]
+            elif(deep and _isFields(value) and self._mergeTarget(self._dict, key) is not None):
+                stack.append((self._ownTable(None, key), value))
+            else:
+                self._setOwn(key, self._mergeValue(value, adopt))
+        while(len(stack) > 0):
+            (table, fields) = stack.pop()
+            if(isinstance(fields, _TableView)):
+                fields = fields._table
+            for key, value in fields.iteritems():
+                if(not self._isKey(key)):
+                    continue
+                if(value is None):
+                    if(key in table):
+                        del table[key]
+                    continue
+                if(deep and _isFields(value) and self._mergeTarget(table, key) is not None):
+                    stack.append((self._ownTable(table, key), value))
+                    continue
+                table[key] = self._mergeValue(value, adopt)
+
+    def diff(self, other):
+        ''' Compare the table with other, an older version of it given as a
+        PyLuaTblParser, a snapshot(), a dict or a list, and return the delta
+        that turns other into this table, for applyPatch(). The delta is a
+        list of operations, each a dict that dump() can write as a Lua table:
+            {'op': 'set', 'path': path, 'value': value}
+            {'op': 'delete', 'path': path}
+            {'op': 'splice', 'path': path, 'index': index, 'delete': count,
+                'insert': items}
+        path is the list of keys leading to the field set or deleted, or to
+        the list of which count items from index on are replaced with items.
+        List items are counted from 0 as in Python. Subtables that are the
+        same object in both versions, as they are in a snapshot until they
+        are changed, or that compare equal are skipped as a whole, so the
+        delta and the cost of finding it grow with what changed.
+        '''
+        if(isinstance(other, PyLuaTblParser)):
+            other = other._dict
+        elif(isinstance(other, _TableView) or isinstance(other, _ListView)):
+            other = other._table
+        return _diffTables(self._dict, other)
+
+    def applyPatch(self, delta):
+        ''' Apply a delta returned by diff(), or read back from its Lua form,
+        to the table in place, one operation after the other.
+        No return value.
+        Throws ValueError on an unknown operation, and KeyError or IndexError
+        when a path does not lead to a field of the table.
+        '''
+        for operation in delta:
+            kind = operation['op']
+            path = operation['path']
+            if(kind == 'splice'):
+                if(len(path) == 0):
+                    self._unshare()
+                    table = self._dict
+                else:
+                    table = self._patchTarget(path + [None])
+                index = operation['index']
+                table[index:index + operation['delete']] = self._loadList(operation['insert'])
+            elif(len(path) == 0):
+                if(kind != 'set'):
+                    raise ValueError('Only \'set\' can replace the whole table.')
+                self.loadDict(operation['value'])
+            elif(kind == 'set'):
+                # A nil list item has no 'value' once written as Lua.
+                value = operation.get('value')
+                if(isinstance(value, dict)):
+                    value = self._loadDict(value)
+                elif(isinstance(value, list)):
+                    value = self._loadList(value)
+                if(len(path) == 1):
+                    self._unshare()
+                    table = self._dict
+                else:
+                    table = self._patchTarget(path)
+                if(value is None and isinstance(table, dict)):
+                    table.pop(path[-1], None)
+                elif(len(path) == 1):
+                    self._setOwn(path[0], value)
+                else:
+                    table[path[-1]] = value
+            elif(kind == 'delete'):
+                if(len(path) == 1):
+                    self._unshare()
+                    del self._dict[path[0]]
+                else:
+                    del self._patchTarget(path)[path[-1]]
+            else:
+                raise ValueError('Unknown patch operation \'' + str(kind) + '\'')
+
+    def edit(self, offset, deleted, inserted):
+        ''' Apply an edit to the text of a table loaded with editable = True:
+        the deleted characters at offset are replaced with the string inserted.
+        Only the innermost subtable that holds the edit and keeps its braces
+        is parsed again and put in place of the old one, so the cost depends
+        on the size of that subtable rather than of the whole text. Tables on
+        the way to it must not have been changed since they were loaded.
+        Returns the list of keys leading to the subtable parsed again, which
+        is empty when the whole text was.
+        Throws LuaParseError when the edited text has grammar errors, and
+        then nothing changes. Throws ValueError when the table was not loaded
+        with editable = True or the edit is outside of the text.
+        '''
+        text = self._text
+        if(text is None):
+            raise ValueError('The table was not loaded with editable = True.')
+        if(offset < 0 or deleted < 0 or offset + deleted > len(text)):
+            raise ValueError('The edit is outside of the text.')
+        newText = text[:offset] + inserted + text[offset + deleted:]
+        delta = len(inserted) - deleted
+        if(self._textSpan is None and not self._isBlank(text)):
+            self._textSpan = _outerSpan(text)
+
+        # Descend to the innermost subtable holding the edit, then go back up
+        # until one is found whose closing brace the edit leaves in place:
+        # the text around it is the same as before, and so is its meaning.
+        (start, end) = self._textSpan or (0, 0)
+        tables = []
+        spans = self._spans
+        while(start < offset and offset + deleted < end):
+            if(spans is None):
+                spans = _Spans(text, start, end)
+                if(len(tables) == 0):
+                    self._spans = spans
+                else:
+                    tables[-1][0].children[index] = spans
+            index = bisect_right(spans.starts, offset - start - 1) - 1
+            tables.append((spans, start, end, index))
+            if(index < 0):
+                break
+            (start, end) = (start + spans.starts[index], start + spans.ends[index])
+            spans = spans.children.get(index)
+        closed = False
+        while(len(tables) > 1 and not closed):
+            (spans, start, end, index) = tables.pop()
+            try:
+                closed = _skipTable(newText, start + 1) == end + delta
+            except LuaParseError:
+                closed = False
+        if(not closed):
+            if(self._isBlank(newText)):
+                # Nothing to load, as in load(), but later edits apply to it.
+                (self._text, self._textSpan, self._spans) = (newText, None, None)
+            else:
+                self.load(newText, editable = True)
+            return []
+
+        value = _LazyTable(newText, start, end + delta).parse()
+        keys = [parentSpans.keys[parentIndex] for (parentSpans, _, _, parentIndex) in tables]
+        if(len(keys) == 1):
+            self._setOwn(keys[0], value)
+        else:
+            table = self._ownTable(None, keys[0])
+            for key in keys[1:-1]:
+                table = self._ownTable(table, key)
+            table[keys[-1]] = value
+        for (parentSpans, _, _, parentIndex) in tables:
+            parentSpans.shift(parentIndex, delta)
+        parentSpans.children.pop(parentIndex, None)
+        self._textSpan = (self._textSpan[0], self._textSpan[1] + delta)
+        self._text = newText
+        return keys
+
     def __getitem__(self, key):
-        return self._dict[key]
+        value = self._dict[key]
+        if(isinstance(value, _LazyTable)):
+            value = value.parse()
+            self._setOwn(key, value)
+        if(self._ownTables is None or not _isTable(value)):
+            return value
+        # The table may be shared with a snapshot, or with other fields after
+        # a dedup load, so the caller gets a stand-in that copies the tables
+        # on the way to a change only.
+        if(isinstance(self._dict, list) and isinstance(key, int) and key < 0):
+            key += len(self._dict)
+        return _proxy(self, None, key, value)
 
     def __setitem__(self, key, value):
-        if((isinstance(key, int) or isinstance(key, float) or isinstance(key, basestring)) 
-            and value is not None):
-            if(isinstance(value, dict)):
-                self._dict[key] = self._loadDict(value)
-            elif(isinstance(value, list)):
-                self._dict[key] = self._loadList(value)
-            else:
-                self._dict[key] = value
+        if(self._isKey(key) and value is not None):
+            self._setOwn(key, self._loadValue(value))
     #----------private functions---------------
-    def _nextTable(self):
-        self._text.trimAll()
-        c = self._text.nextChar()
-        if(c != '{'):
-            message =  'Expecting \'{\' when parsing table. Got \'' + c + '\''
-            raise LuaParseError(message)
-        self._text.moveNext()
-        self._text.trimAll()
-        if(self._text.nextChar() == '}'):
-            self._text.moveNext()
-            return _TokenTable([])
-        
-        table = self._nextFieldList()
-        if(self._text.nextChar() != '}'):
-            message =  'Expecting \'}\' when parsing table. Got \'' + str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)
-        self._text.moveNext()
+    def _loadCached(self, cache, name, stamp):
+        table = cache._get(name, stamp)
+        if(table is None):
+            return False
+        self._setTable(table)
+        return True
 
-        if(isinstance(table, dict)):
-            self._clearNilKey(table)
-        return _TokenTable(table)
+    def _setTable(self, table):
+        self._dict = table
+        self._shared = False
+        self._ownTables = None
+        self._copies = None
+        self._sharesTables = False
+        self._text = None
+        self._textSpan = None
+        self._spans = None
+
+    def _markShared(self):
+        # Equal subtables of the table are one; each is copied when it is
+        # changed, as after snapshot().
+        self._ownTables = {}
+        self._copies = {}
+        self._sharesTables = True
+
+    def _unshare(self):
+        # Copies the outermost table if a snapshot refers to it.
+        if(self._shared):
+            if(isinstance(self._dict, dict)):
+                self._dict = dict(self._dict)
+            elif(isinstance(self._dict, LuaTable)):
+                self._dict = self._dict.copy()
+            else:
+                self._dict = list(self._dict)
+            self._shared = False
+
+    def _setOwn(self, key, value):
+        # Stores value, which no snapshot refers to, under key. The outermost
+        # table is copied first if a snapshot refers to it.
+        self._unshare()
+        self._dict[key] = value
+        if(self._ownTables is not None and _isTable(value)):
+            self._ownTables[id(value)] = value
+
+    def _ownTable(self, table, key):
+        # The subtable under key in table, or in the outermost table if table
+        # is None, copied first if it may be shared. table must be one the
+        # class owns.
+        if(table is None):
+            self._unshare()
+            table = self._dict
+        value = table[key]
+        owned = self._ownTables
+        if(isinstance(value, _LazyTable)):
+            value = value.parse()
+        elif(owned is None or id(value) in owned or not _isTable(value)):
+            return value
+        else:
+            copy = _tableCopy(value)
+            self._copies[id(value)] = id(copy)
+            value = copy
+        table[key] = value
+        if(owned is not None):
+            owned[id(value)] = value
+        return value
 
-    def _nextFieldList(self):
+    @staticmethod
+    def _isKey(key):
+        return isinstance(key, int) or isinstance(key, float) or isinstance(key, basestring)
+
+    @staticmethod
+    def _mergeValue(value, adopt):
+        # What merge() stores for value. A snapshot's tables are always
+        # copied, as the snapshot must not change.
+        if(adopt and not (isinstance(value, _TableView) or isinstance(value, _ListView))):
+            return value
+        return PyLuaTblParser._loadValue(value)
+
+    @staticmethod
+    def _mergeTarget(table, key):
+        # The dict or LuaTable table holds under key, which merge() merges
+        # into, or None.
+        if(isinstance(table, list)):
+            if(not (isinstance(key, int) and -len(table) <= key < len(table))):
+                return None
+        elif(key not in table):
+            return None
+        value = _tableItem(table, key)
+        if(isinstance(value, dict) or isinstance(value, LuaTable)):
+            return value
+        return None
+
+    def _patchTarget(self, path):
+        # The subtable holding the field path leads to, for applyPatch(). It
+        # and the tables on the way are copied if a snapshot may share them.
+        table = self._ownTable(None, path[0])
+        for key in path[1:-1]:
+            table = self._ownTable(table, key)
+        return table
+
+    def _feedTokens(self):
+        # Parses the tokens fed so far. Without windows to fetch more from,
+        # _nextTable() stops where a field might not be complete yet.
+        (text, tokens, resume, table, lexAt) = self._feeding
+        if(len(tokens) == 0 or (resume is None and len(tokens[0]) == 0)):
+            return
+        self._tokens = tokens
+        self._windows = None
+        self._pos = 0
+        try:
+            table = self._nextTable(resume)
+            if(table is None):
+                (tokens, resume) = (self._tokens, self._resume)
+        except LuaParseError:
+            self._feeding = None
+            raise
+        finally:
+            self._tokens = None
+            self._resume = None
+        self._feeding = (text, tokens, resume, table, lexAt)
+
+    # Converts the values _nextTable() cannot convert inline. Instrumented
+    # loads time it by replacing it for the instance.
+    _parseValue = staticmethod(_parseValue)
+
+    def _nextTable(self, resume = None):
+        # Tables are parsed without recursion. The tables that are still open
+        # sit on an explicit stack together with the key the inner table will
+        # be stored under, so nesting depth is only limited by memory. Fields
+        # are read inline; plain numbers and strings without escapes are
+        # converted in place, anything else goes through _parseValue.
+        # The tokens come a window at a time; more are fetched when the next
+        # field might run past the end of the current window. Without windows
+        # (see feed()), the state is kept in self._resume instead, None is
+        # returned, and parsing goes on when called again with it.
+        # For lua_tables, each table is a LuaTable from the start: values
+        # without key are appended to its array part, and a hash part is made
+        # for the first field with a key.
+        tokens = self._tokens
+        charKinds = _char_kinds
+        parseValue = self._parseValue
+        arrays = self._arrays
+        strings = self._strings
+        luaTables = self._luaTables
+        tablePool = self._tablePool
+        index = self._pos
+        if(resume is None):
+            if(tokens[index] != '{'):
+                raise LuaParseError(_unexpectedMessage('Expecting \'{\' when parsing table.', \
+                    tokens[index]))
+            index += 1
+            stack = []
+            result = LuaTable([]) if luaTables else {}
+            arrayIndex = 1
+            hasKey = False
+            hasNil = False
+        else:
+            (stack, result, arrayIndex, hasKey, hasNil) = resume
+        # The window is only cut down when more is fetched, so that tables
+        # following each other in one window do not copy the rest of it.
+        if(tokens[-1] == ''):
+            lastIndex = len(tokens)
+        else:
+            lastIndex = len(tokens) - _FIELD_TOKENS
+        while True:
+            if(index > lastIndex):
+                if(self._windows is None):
+                    self._tokens = tokens[index:]
+                    self._resume = (stack, result, arrayIndex, hasKey, hasNil)
+                    return None
+                (tokens, lastIndex) = self._moreTokens(tokens[index:])
+                index = 0
+            token = tokens[index]
+            if(token == '}'):
+                index += 1
+                if(luaTables):
+                    value = _luaTable(result, hasNil)
+                elif(hasKey):
+                    if(hasNil):
+                        self._clearNilKey(result)
+                    value = result
+                else:
+                    value = result.values()
+                if(len(stack) == 0):
+                    break
+                if(tablePool is not None):
+                    value = _pooledTable(tablePool, value)
+                (result, arrayIndex, hasKey, hasNil, key, isIndex) = stack.pop()
+            else:
+                isIndex = False
+                if(token == '['):
+                    key = self._asIndex(tokens[index + 1])
+                    if(tokens[index + 2] != ']'):
+                        raise LuaParseError(_unexpectedMessage('Expecting \']\' after index.', \
+                            tokens[index + 2]))
+                    if(tokens[index + 3] != '='):
+                        raise LuaParseError(_unexpectedMessage('Expecting \'=\' after table index.', \
+                            tokens[index + 3]))
+                    if(strings is not None and type(key) is str):
+                        key = strings[key]
+                    isIndex = True
+                    index += 4
+                    token = tokens[index]
+                elif(len(token) == 0):
+                    raise LuaParseError(_unexpectedMessage('Expecting \'}\' when parsing table.', token))
+                elif(tokens[index + 1] == '=' and token != '{'):
+                    if(charKinds.get(token[:1]) == _CHAR_NAME and token not in _reserved_names):
+                        key = token if strings is None else strings[token]
+                    else:
+                        key = self._asName(token)
+                    index += 2
+                    token = tokens[index]
+                else:
+                    key = None
+
+                if(token == '{'):
+                    run = None
+                    if(arrays):
+                        (run, tokens, index, lastIndex) = self._nextArray(tokens, index, lastIndex)
+                    if(run is None):
+                        stack.append((result, arrayIndex, hasKey, hasNil, key, isIndex))
+                        result = LuaTable([]) if luaTables else {}
+                        arrayIndex = 1
+                        hasKey = False
+                        hasNil = False
+                        index += 1
+                        continue
+                    value = run
+                    if(tablePool is not None):
+                        value = _pooledTable(tablePool, value)
+                else:
+                    kind = charKinds.get(token[:1])
+                    if(kind == _CHAR_NUMBER and token.isdigit()):
+                        value = int(token)
+                    elif(kind == _CHAR_STRING and len(token) > 1 and '\\' not in token):
+                        value = token[1:-1]
+                        if(strings is not None):
+                            value = strings[value]
+                    else:
+                        value = parseValue(token)
+                    index += 1
+
+            if(key is None):
+                if(value is None):
+                    hasNil = True
+                if(luaTables):
+                    result._array.append(value)
+                else:
+                    result[arrayIndex] = value
+                arrayIndex += 1
+            else:
+                hasKey = True
+                if(value is not None and not (isIndex and isinstance(key, int) and key < arrayIndex)):
+                    if(luaTables):
+                        if(result._hash is None):
+                            result._hash = {}
+                        result._hash[key] = value
+                    else:
+                        result[key] = value
+
+            token = tokens[index]
+            if(token == ',' or token == ';'):
+                index += 1
+            elif(token != '}'):
+                raise LuaParseError(_unexpectedMessage( \
+                    'Expecting \',\' or \';\' when seeking for next field separator.', token))
+        self._tokens = tokens
+        self._pos = index
+        return value
+
+    def _nextArray(self, tokens, index, lastIndex):
+        # tokens[index] is a '{'. Returns (array, tokens, index, lastIndex)
+        # with index after the '}' if the table is a list of numbers of one
+        # kind, or (None, tokens, index, lastIndex) with index at the '{' to
+        # parse it as usual. Windows are fetched as the list goes on.
+        blocks = []
+        (pattern, convert, typecode) = (None, None, None)
+        fetched = False
+        position = index + 1
+        block = _ARRAY_FIRST_BLOCK
+        while True:
+            # Blocks start at a value, so the values are every other token.
+            step = min(block, lastIndex - position)
+            step -= step % 2
+            if(step <= 0):
+                if(self._windows is None or tokens[-1] == ''):
+                    break
+                tokens = tokens[position:] + self._windows.next()
+                lastIndex = len(tokens) if tokens[-1] == '' else len(tokens) - _FIELD_TOKENS
+                position = 0
+                fetched = True
+                continue
+            try:
+                end = tokens.index('}', position, position + step)
+            except ValueError:
+                end = None
+            blockTokens = tokens[position:(position + step if end is None else end)]
+            if(not _array_separators.issuperset(blockTokens[1::2])):
+                break
+            text = ','.join(blockTokens[::2]) + ','
+            if(pattern is None):
+                if(_int_run_pattern.match(text) is not None):
+                    (pattern, convert, typecode) = (_int_run_pattern, int, 'l')
+                elif(_float_run_pattern.match(text) is not None):
+                    (pattern, convert, typecode) = (_float_run_pattern, float, 'd')
+                else:
+                    break
+            elif(pattern.match(text) is None):
+                break
+            blocks.append(blockTokens)
+            if(end is not None):
+                try:
+                    values = array(typecode, map(convert, chain.from_iterable( \
+                        [blockTokens[::2] for blockTokens in blocks])))
+                    return (values, tokens, end + 1, lastIndex)
+                except OverflowError:
+                    position = end
+                    break
+            position += step
+            block *= 2
+        if(not fetched):
+            return (None, tokens, index, lastIndex)
+        # The tokens before position are gone from tokens; they are put back.
+        tokens = ['{'] + list(chain.from_iterable(blocks)) + tokens[position:]
+        if(tokens[-1] == ''):
+            lastIndex = len(tokens)
+        else:
+            lastIndex = len(tokens) - _FIELD_TOKENS
+        return (None, tokens, 0, lastIndex)
+
+    def _moreTokens(self, tokens):
+        # Appends windows to tokens until a whole field fits, and returns them
+        # with the last index a field can start at.
+        while(len(tokens) == 0 or tokens[-1] != ''):
+            if(len(tokens) >= _FIELD_TOKENS):
+                return (tokens, len(tokens) - _FIELD_TOKENS)
+            tokens = tokens + self._windows.next()
+        return (tokens, len(tokens))
+
+    @staticmethod
+    def _isBlank(s):
+        if(isinstance(s, memoryview)):
+            s = s.tobytes()
+        return _blank_pattern.match(s) is not None
+
+    def _loadParallel(self, s, workers):
+        # The outermost table is cut up by _outerTokens() as for a lazy load,
+        # and its subtables, parsed by the workers, are put in place of the
+        # lazy ones before its fields are read, so nil values and positions
+        # come out as from _nextTable().
+        (tokens, tables) = _outerTokens(s)
+        if(len(tokens[0]) == 0 and self._isBlank(s)):
+            return
+        indexes = iter(sorted(tables))
+        parsed = {}
+        for table in _iterFieldTables(_fieldBatches(s, tables, workers), workers):
+            parsed[indexes.next()] = table
+        self._tokens = tokens
+        self._tables = parsed
+        self._pos = 0
+        try:
+            self._setTable(self._nextLazyTable())
+        finally:
+            self._tokens = None
+            self._tables = None
+
+    def _nextLazyTable(self):
+        # The outermost table is read field by field like in _nextTable. Its
+        # subtables were already cut out by _outerTokens() and are stored as
+        # they are, to be parsed when they are first looked up.
+        tokens = self._tokens
+        tables = self._tables
+        index = self._pos
+        if(tokens[index] != '{'):
+            raise LuaParseError(_unexpectedMessage('Expecting \'{\' when parsing table.', \
+                tokens[index]))
+        index += 1
         result = {}
         arrayIndex = 1
         hasKey = False
+        hasNil = False
         while True:
-            omit = False
-            (key, value) = self._nextField()
+            token = tokens[index]
+            if(token == '}'):
+                index += 1
+                break
+            isIndex = False
+            if(token == '['):
+                key = self._asIndex(tokens[index + 1])
+                if(tokens[index + 2] != ']'):
+                    raise LuaParseError(_unexpectedMessage('Expecting \']\' after index.', \
+                        tokens[index + 2]))
+                if(tokens[index + 3] != '='):
+                    raise LuaParseError(_unexpectedMessage('Expecting \'=\' after table index.', \
+                        tokens[index + 3]))
+                isIndex = True
+                index += 4
+                token = tokens[index]
+            elif(len(token) == 0):
+                raise LuaParseError(_unexpectedMessage('Expecting \'}\' when parsing table.', token))
+            elif(tokens[index + 1] == '=' and token != '{'):
+                key = self._asName(token)
+                index += 2
+                token = tokens[index]
+            else:
+                key = None
+
+            if(token == '{'):
+                value = tables[index]
+            else:
+                value = _parseValue(token)
+            index += 1
+
             if(key is None):
-                key = arrayIndex
+                if(value is None):
+                    hasNil = True
+                result[arrayIndex] = value
                 arrayIndex += 1
             else:
                 hasKey = True
-                if(value is None or (isinstance(key, int) and  key < arrayIndex)):
-                    omit = True
-            if(omit is False):
-                result[key] = value
-            hasNextField = self._hasNextField()
-            if(hasNextField == False):
-                break
+                if(value is not None and not (isIndex and isinstance(key, int) and key < arrayIndex)):
+                    result[key] = value
+
+            token = tokens[index]
+            if(token == ',' or token == ';'):
+                index += 1
+            elif(token != '}'):
+                raise LuaParseError(_unexpectedMessage( \
+                    'Expecting \',\' or \';\' when seeking for next field separator.', token))
+        self._pos = index
         if(hasKey):
+            if(hasNil):
+                self._clearNilKey(result)
             return result
         return result.values()
 
-    def _hasNextFieldSeparator(self):
-        self._text.trimAll()
-        c = self._text.nextChar()
-        if(c == ',' or c == ';'):
-            self._text.moveNext()
-            return True
-        elif(c == '}'):
-            return False
-        else:
-            message =  'Expecting \',\' or \';\' when seeking for next field separator. Got \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)
-
-    def _hasNextField(self):
-        self._text.trimAll()
-        hasNextSeparator = self._hasNextFieldSeparator()
-        if(hasNextSeparator):
-            self._text.trimAll()
-            if(self._text.nextChar() != '}'):
-                return True
-        return False
-
-    def _nextField(self):
-        key = None
-        value = None
-        c = self._text.nextTokenChar()
-        if(c == '{'):
-            key = self._nextTable()
-        elif(c == '['):
-            (islongstring, longstring) = self._text.tryNextLongString()
-            if(islongstring):
-                key = longstring
-            else:   
-                self._text.moveNext()
-                key = self._nextIndex()
-                if(self._text.nextTokenChar() != '='):
-                    raise LuaParseError('Expecting \'=\' before \'' + str(self._text.nextChar()) + '\'')
-                self._text.moveNext()
-                value = self._nextValue()
-                return (key, value)
-        else:
-            key = self._text.nextTokenBefore(['=', ',', ';', '}'])
-            if(key is None):
-                message =  'Expecting field or key before \'' + \
-                    str(self._text.nextChar()) + '\''
-                raise LuaParseError(message)
-        c = self._text.nextTokenChar()
-        if(c == '='):
-            self._text.moveNext()
-            key = self._asName(key)
-            value = self._nextValue()
-        else:
-            value = self._asValue(key)
-            key = None
-        return (key, value)
-
-    def _nextIndex(self):
-        token = self._text.nextTokenBefore([']'])
-        if(token is None):
-            message =  'Expecting index before \'' + \
-                str(self._text.nextChar()) + '\''
-            raise LuaParseError(message)
-        if(self._text.nextTokenChar() != ']'):
-            message =  'Expecting \']\' before \'' + \
-                str(self._text.nextChar()) + '\''
-            raise LuaParseError(message)
-        self._text.moveNext()
-
-        if(token.getType() == _TOKEN_NONE):
-            message =  'Table key cannot be nil! Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)    
-        if(token.getType() == _TOKEN_BOOLEAN):
-            message =  'Table key cannot be boolean! Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)
-        if(token.getType() == _TOKEN_NAME):
-            message =  'Table key cannot be name! Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)    
-        return token.getValue()
-    
-    def _nextValue(self):
-        value = None
-        token = None
-        c = self._text.nextTokenChar()
-        if(c == '{'):
-            value = self._nextTable().getValue()
-        else:
-            token = self._text.nextTokenBefore([',', ';', '}'])
-            if(token is None):
-                message =  'Expecting value before \'' + \
-                    str(self._text.nextChar()) + '\''
-                raise LuaParseError(message)         
-            value = self._asValue(token)
-        return value
-
-    def _nextString(self):
-        return self._text.nextString()
+    @staticmethod
+    def _asIndex(token):
+        key = _parseValue(token)
+        if(key is None):
+            raise LuaParseError('Table key cannot be nil! At \'' + token + '\'')
+        if(key is True or key is False):
+            raise LuaParseError('Table key cannot be boolean! At \'' + token + '\'')
+        return key
 
     @staticmethod
-    def _asValue(token):
-        if(token.getType() == _TOKEN_NAME):
-            message =  'Lua name cannot appear as value! At \'' + \
-                token.getValue() + '\''
-            raise LuaParseError(message)
-        return token.getValue()  
-
-    def _asName(self, token):
-        if(token.getType() == _TOKEN_TABLE):
-            message =  'Table key cannot be table! Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)
-        if(token.getType() == _TOKEN_BOOLEAN):
-            message =  'Table key cannot be boolean! Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)
-        if(token.getType() == _TOKEN_NONE):
-            message =  'Table key cannot be nil! Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)    
-        if(token.getType() == _TOKEN_BOOLEAN):
-            message =  'Table key cannot be boolean! Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)   
-        if(token.getType() == _TOKEN_NUMBER):
-            message =  'Table key cannot be number! Got ' + str(token.getValue()) + ' Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message) 
-        if(token.getType() == _TOKEN_STRING):
-            message =  'Table key cannot be string! Before \'' + \
-                str(self._text.nextTokenText()) + '\''
-            raise LuaParseError(message)
-        return token.getValue()
-
-    def _dumpItem(self, stream, item):
+    def _asName(token):
+        kind = _char_kinds.get(token[:1])
+        if(kind == _CHAR_NAME and token not in _reserved_names):
+            return token
+        if(kind == _CHAR_NAME):
+            value = _parseValue(token)
+            if(value is None):
+                message = 'Table key cannot be nil!'
+            elif(value is True or value is False):
+                message = 'Table key cannot be boolean!'
+            else:
+                message = 'Table key cannot be number! Got ' + token
+        elif(kind == _CHAR_NUMBER):
+            _parseValue(token)
+            message = 'Table key cannot be number! Got ' + token
+        elif(kind == _CHAR_STRING or kind == _CHAR_BRACKET):
+            _parseValue(token)
+            message = 'Table key cannot be string! Got ' + token
+        else:
+            message = _unexpectedMessage('Expecting field or key.', token)
+        raise LuaParseError(message)
+
+    def _dumpTo(self, write, bufferSize):
+        chunks = _DumpBuffer(write, bufferSize)
+        self._dumpItem(chunks, self._dict, '\n')
+        chunks.flush(0)
+        return chunks.written
+
+    def _dumpItem(self, chunks, item, indent):
+        # Appends the Lua text of item to chunks. indent is the line break
+        # and indentation the fields of a dict in item go after. Tables are
+        # written without recursion: the ones still open sit on a stack with
+        # the iterator over their fields, so nesting depth is only limited by
+        # memory. Plain values are written inline.
+        opened = self._dumpOpen(chunks, item, indent)
+        if(opened is None):
+            return
+        scalarDumpers = _scalar_dumpers
+        indentStep = ' ' * _INDENT_STEP
+        stack = [opened]
+        while True:
+            (fields, innerIndent, separator, closing, isDict) = opened
+            opened = None
+            if(isDict):
+                for key, value in fields:
+                    if(isinstance(key, basestring)):
+                        chunks.append('[' + _quoteString(key) + '] = ')
+                    else:
+                        chunks.append('[')
+                        self._dumpOpen(chunks, key, innerIndent)
+                        chunks.append('] = ')
+                    valueType = type(value)
+                    dumper = scalarDumpers.get(valueType)
+                    if(dumper is not None):
+                        chunks.append(dumper(value))
+                    elif(valueType is list and len(value) > 0):
+                        # Plain lists and dicts are opened here, the rest by
+                        # _dumpOpen().
+                        chunks.append('{ ')
+                        opened = (iter(value), innerIndent, ', ', ' }', False)
+                        break
+                    elif(valueType is dict and len(value) > 0):
+                        valueIndent = innerIndent + indentStep
+                        chunks.append('{ ' + valueIndent)
+                        opened = (value.iteritems(), valueIndent, ',' + valueIndent, \
+                            innerIndent + '}', True)
+                        break
+                    else:
+                        opened = self._dumpOpen(chunks, value, innerIndent)
+                        if(opened is not None):
+                            break
+                    chunks.append(separator)
+                    if(len(chunks) >= chunks.checkAt):
+                        chunks.check()
+            else:
+                for value in fields:
+                    valueType = type(value)
+                    dumper = scalarDumpers.get(valueType)
+                    if(dumper is not None):
+                        chunks.append(dumper(value))
+                    elif(valueType is list and len(value) > 0):
+                        # Plain lists and dicts are opened here, the rest by
+                        # _dumpOpen().
+                        chunks.append('{ ')
+                        opened = (iter(value), innerIndent, ', ', ' }', False)
+                        break
+                    elif(valueType is dict and len(value) > 0):
+                        valueIndent = innerIndent + indentStep
+                        chunks.append('{ ' + valueIndent)
+                        opened = (value.iteritems(), valueIndent, ',' + valueIndent, \
+                            innerIndent + '}', True)
+                        break
+                    else:
+                        opened = self._dumpOpen(chunks, value, innerIndent)
+                        if(opened is not None):
+                            break
+                    chunks.append(separator)
+                    if(len(chunks) >= chunks.checkAt):
+                        chunks.check()
+            if(opened is not None):
+                # The fields of the table opened are written first.
+                stack.append(opened)
+                continue
+            stack.pop()
+            chunks[-1] = closing
+            if(len(stack) == 0):
+                return
+            opened = stack[-1]
+            chunks.append(opened[2])
+            if(len(chunks) >= chunks.checkAt):
+                chunks.check()
+
+    def _dumpOpen(self, chunks, item, indent):
+        # Appends item if it is no table or an empty one, and returns None.
+        # Otherwise appends the opening of the table and returns what
+        # _dumpItem() writes its fields with: an iterator over them, the
+        # indent they go after, the separator after each, what replaces the
+        # last separator, and whether they are pairs.
+        itemType = type(item)
+        if(itemType is not list and itemType is not dict):
+            if(isinstance(item, LuaTable) and item._hash is None):
+                # Without a hash part it is written as the list it then is.
+                item = item._array or []
+            elif(isinstance(item, _LazyTable)):
+                item = item.parse()
+            dumper = _scalar_dumpers.get(type(item))
+            if(dumper is not None):
+                chunks.append(dumper(item))
+                return None
         if(isinstance(item, list)):
-            self._dumpList(stream, item)
-        elif(isinstance(item, dict)):
-            self._dumpDict(stream, item)
+            if(len(item) == 0):
+                chunks.append('{ }')
+                return None
+            chunks.append('{ ')
+            return (iter(item), indent, ', ', ' }', False)
+        elif(isinstance(item, dict) or isinstance(item, LuaTable)):
+            if(len(item) == 0):
+                chunks.append('{ }')
+                return None
+            innerIndent = indent + ' ' * _INDENT_STEP
+            chunks.append('{ ' + innerIndent)
+            return (item.iteritems(), innerIndent, ',' + innerIndent, indent + '}', True)
+        elif(isinstance(item, array)):
+            self._dumpArray(chunks, item)
         elif(isinstance(item, basestring)):
-            self._dumpString(stream, item)
-        elif(item is True):
-            stream.write('true')
-        elif(item is False):
-            stream.write('false')
-        elif(item is None):
-            stream.write('nil')
-        else:
-            stream.write(str(item))
-
-    def _dumpString(self, stream, s):
-        length = len(s)
-        stream.write('\'')
-        for index in xrange(length):
-            c = s[index]
-            if c == "'":
-                stream.write('\\')
-                stream.write(c)
-            elif c in _escape_dict_back_keys:
-                stream.write('\\')
-                stream.write(_escape_dict_back[c])
-            elif c not in printable:
-                stream.write('\\')
-                stream.write(str(ord(c)))
+            chunks.append(_dumpString(item))
+        elif(isinstance(item, float)):
+            chunks.append(repr(item))
+        else:
+            chunks.append(str(item))
+        return None
+
+    def _dumpArray(self, chunks, a):
+        # Written like a list of the same numbers, a block of items per chunk.
+        if(len(a) == 0):
+            chunks.append('{ }')
+            return
+        dumper = repr if a.typecode in 'fd' else str
+        chunks.append('{ ')
+        for start in xrange(0, len(a), _ARRAY_DUMP_BLOCK):
+            chunks.append(', '.join(map(dumper, a[start:start + _ARRAY_DUMP_BLOCK])))
+            chunks.append(', ')
+            if(len(chunks) >= chunks.checkAt):
+                chunks.check()
+        chunks[-1] = ' }'
+
+    def _dumpDict(self, chunks, d, indent):
+        if(len(d) == 0):
+            chunks.append('{ }')
+            return
+        innerIndent = indent + ' ' * _INDENT_STEP
+        separator = ',' + innerIndent
+        chunks.append('{ ' + innerIndent)
+        scalarDumpers = _scalar_dumpers
+        for key, value in d.iteritems():
+            if(isinstance(key, basestring)):
+                chunks.append('[' + _quoteString(key) + '] = ')
             else:
-                stream.write(c)
-        stream.write('\'')
-
-    def _dumpList(self, stream, l):
-        stream.write('{ ')
-        length = len(l)
-        for index in xrange(length):
-            self._dumpItem(stream, l[index])
-            if(index < length - 1):
-                stream.write(',')
-            stream.write(' ')
-        stream.write('}')
-
-    def _dumpDict(self, stream, d):
-        stream.write('{ ')
-        length = len(d)
-        k = d.keys()
-        v = d.values()
-        if(length > 0):
-            self._changeLine(stream, _INDENT_STEP)
-        for index in xrange(length):
-            stream.write('[')
-            self._dumpItem(stream, k[index])
-            stream.write('] = ')
-            self._dumpItem(stream, v[index])
-            if(index < length - 1):
-                stream.write(',')
-                self._changeLine(stream, 0)
+                chunks.append('[')
+                self._dumpItem(chunks, key, innerIndent)
+                chunks.append('] = ')
+            dumper = scalarDumpers.get(type(value))
+            if(dumper is not None):
+                chunks.append(dumper(value))
             else:
-                self._changeLine(stream, -_INDENT_STEP)
-        stream.write('}')
-
-    def _changeLine(self, stream, indent):
-        stream.write('\n')
-        self._indent += indent
-        for i in xrange(self._indent):
-            stream.write(' ')
+                self._dumpItem(chunks, value, innerIndent)
+            chunks.append(separator)
+            if(len(chunks) >= chunks.checkAt):
+                chunks.check()
+        chunks[-1] = indent + '}'
 
     @staticmethod
     def _loadDict(d):
+        # A copy of the fields of the mapping d that a table can hold.
         result = {}
-        for key, value in d.iteritems():
-            v = None
-            if((isinstance(key, int) or isinstance(key, float) or isinstance(key, basestring))
-                and value is not None):
-                if(isinstance(value, dict)):
-                    v = PyLuaTblParser._loadDict(value)
-                elif(isinstance(value, list)):
-                    v = PyLuaTblParser._loadList(value)
-                else:
-                    v = value
-                result[key] = v
+        _fillLoaded([(d, result, True)])
         return result
 
+    @staticmethod
+    def _loadValue(value):
+        # A copy of value to store in the table.
+        stack = []
+        value = _loadedValue(value, stack)
+        _fillLoaded(stack)
+        return value
+
     @staticmethod
     def _loadList(l):
         result = []
-        for item in l:
-            if isinstance(item, dict):
-                result.append(PyLuaTblParser._loadDict(item))
-            elif(isinstance(item, list)):
-                result.append(PyLuaTblParser._loadList(item))
-            else:
-                result.append(item)
+        _fillLoaded([(l, result, False)])
         return result
 
     @staticmethod
@@ -756,6 +1627,1851 @@ class PyLuaTblParser:
         for key in nilKeys:
             d.pop(key)
 
+def _loadedValue(value, stack):
+    # value as the table stores it: views are unwrapped, lazy tables parsed,
+    # and tables copied. A copy is returned empty; it is filled from the
+    # table by _fillLoaded(), which takes it from stack.
+    if(isinstance(value, _TableView) or isinstance(value, _ListView)):
+        value = value._table
+    if(isinstance(value, dict)):
+        copy = {}
+        stack.append((value, copy, True))
+    elif(isinstance(value, list)):
+        copy = []
+        stack.append((value, copy, False))
+    elif(isinstance(value, array)):
+        return value[:]
+    elif(isinstance(value, LuaTable)):
+        copy = LuaTable()
+        if(value._array is not None):
+            copy._array = []
+            stack.append((value._array, copy._array, False))
+        if(value._hash is not None):
+            copy._hash = {}
+            stack.append((value._hash, copy._hash, False))
+    elif(isinstance(value, _LazyTable)):
+        return value.parse()
+    else:
+        return value
+    return copy
+
+# The key types _isKey() takes, for a quick check of most keys.
+_loaded_key_types = frozenset([str, unicode, int, bool, float])
+
+def _fillLoaded(stack):
+    # Fills the copies on stack, (table, copy, whether to leave out fields
+    # no table can hold) each, without recursion, as _internedCopy() does.
+    # Plain values are stored as they are without a call.
+    isKey = PyLuaTblParser._isKey
+    plainTypes = _scalar_dumpers
+    keyTypes = _loaded_key_types
+    while(len(stack) > 0):
+        (source, target, checked) = stack.pop()
+        if(isinstance(target, list)):
+            append = target.append
+            for item in source:
+                if(type(item) in plainTypes):
+                    append(item)
+                else:
+                    append(_loadedValue(item, stack))
+        elif(checked):
+            for key, value in source.iteritems():
+                if(value is not None and (type(key) in keyTypes or isKey(key))):
+                    if(type(value) in plainTypes):
+                        target[key] = value
+                    else:
+                        target[key] = _loadedValue(value, stack)
+        else:
+            for key, value in source.iteritems():
+                if(type(value) in plainTypes):
+                    target[key] = value
+                else:
+                    target[key] = _loadedValue(value, stack)
+
+#----------dumper--------------------------
+# Characters that cannot stand for themselves in a quoted string.
+_dump_escape_pattern = re.compile(r"[\x00-\x1f\x7f-\xff'\\]")
+
+# What each character is written as inside a quoted string. Decimal escapes
+# always take three digits so that a digit after them is not read as theirs.
+_dump_escapes = {}
+for code in xrange(256):
+    c = chr(code)
+    if(c in _escape_dict_back):
+        _dump_escapes[c] = '\\' + _escape_dict_back[c]
+    elif(_dump_escape_pattern.match(c) is not None):
+        _dump_escapes[c] = '\\%03d' % code
+    else:
+        _dump_escapes[c] = c
+_dump_escapes['\''] = '\\\''
+
+# Strings at least this long are written as long strings when that spares
+# escaping them.
+_LONG_STRING_LENGTH = 64
+
+def _quoteString(s):
+    ''' Returns s as a Lua string in single quotes.
+    '''
+    if(isinstance(s, unicode)):
+        s = s.encode('utf-8')
+    if(_dump_escape_pattern.search(s) is None):
+        return '\'' + s + '\''
+    return '\'' + ''.join(map(_dump_escapes.__getitem__, s)) + '\''
+
+def _dumpString(s):
+    ''' Returns s as a Lua string, in a long bracket when it is long and has
+    characters to escape.
+    '''
+    if(isinstance(s, unicode)):
+        s = s.encode('utf-8')
+    if(_dump_escape_pattern.search(s) is None):
+        return '\'' + s + '\''
+    # Lua drops a newline right after the opening bracket and turns '\r'
+    # into '\n' inside long strings, so such strings stay quoted.
+    if(len(s) >= _LONG_STRING_LENGTH and s[0] != '\n' and s.find('\r') < 0):
+        level = 0
+        while True:
+            equals = '=' * level
+            if(s.find(']' + equals + ']') < 0 and not s.endswith(']' + equals)):
+                return '[' + equals + '[' + s + ']' + equals + ']'
+            level += 1
+    return '\'' + ''.join(map(_dump_escapes.__getitem__, s)) + '\''
+
+# After how many more chunks _DumpBuffer checks whether it holds enough bytes
+# to write them.
+_CHECK_CHUNKS = 512
+
+class _DumpBuffer(list):
+    ''' The chunks of text a dump is made of. With a write function, they are
+    passed on to it about bufferSize bytes at a time while the dump goes on,
+    so only that much of the text is held at once.
+    The dump loops call check() whenever len() reaches checkAt.
+    '''
+    __slots__ = ('write', 'bufferSize', 'checkAt', 'counted', 'size', 'written')
+
+    def __init__(self, write = None, bufferSize = 0):
+        list.__init__(self)
+        self.write = write
+        self.bufferSize = bufferSize
+        self.written = 0
+        self._reset()
+
+    def check(self):
+        self.size += sum(map(len, self[self.counted:]))
+        self.counted = len(self)
+        if(self.size >= self.bufferSize):
+            self.flush()
+        else:
+            self.checkAt = self.counted + _CHECK_CHUNKS
+
+    def flush(self, keep = 1):
+        # While dumping, the last chunk is kept: the dump loops replace the
+        # separator they appended last once they know it ends the table.
+        if(len(self) <= keep):
+            return
+        text = ''.join(self[:len(self) - keep])
+        del self[:len(self) - keep]
+        self.write(text)
+        self.written += len(text)
+        self._reset()
+
+    def _reset(self):
+        self.counted = 0
+        self.size = 0
+        if(self.write is None):
+            self.checkAt = sys.maxint
+        else:
+            self.checkAt = _CHECK_CHUNKS
+
+_scalar_dumpers = {str:_dumpString, unicode:_dumpString, int:str, long:str, float:repr, \
+                   bool:lambda value: 'true' if value else 'false', type(None):lambda value: 'nil'}
+
+#----------numeric arrays------------------
+# Lists of numbers are checked a block of tokens at a time, blocks doubling in
+# size, so that a list that turns out not to be one is given up on after about
+# as many tokens as it started with numbers, and converted all at once.
+_ARRAY_FIRST_BLOCK = 16
+_ARRAY_DUMP_BLOCK = 4096
+_int_run_pattern = re.compile(r'(?:[+-]?\d+,)*\Z')
+_float_run_pattern = re.compile(r'(?:[+-]?(?:(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+),)*\Z')
+_array_separators = frozenset([',', ';'])
+
+#----------lua tables----------------------
+class LuaTable(object):
+    ''' A Lua table laid out as Lua lays it out: the values at keys 1 to n in
+    a list, its array part, and all other fields in a dict, its hash part.
+    load(s, lua_tables = True) builds every table as a LuaTable. It is a
+    mutable mapping from Lua keys to values, so a list is counted from 1 as
+    in Lua; nil (None) values are not stored, and setting a key to None
+    removes it. append() adds the value at key n + 1 in O(1).
+    Iteration goes through the array part in order, then the hash part.
+    '''
+    __slots__ = ('_array', '_hash')
+    __hash__ = None
+
+    def __init__(self, items = None, fields = None):
+        ''' items are the values at keys 1, 2, ... and fields the other
+        fields, as a dict or pairs; neither is copied when it is a list or a
+        dict. As in Lua, the items after a None are not at 1 to n and go to
+        the hash part.
+        '''
+        self._array = None
+        self._hash = None
+        if(items is not None):
+            self._array = items if isinstance(items, list) else list(items)
+            if(None in self._array):
+                if(self._array is items):
+                    self._array = items[:]
+                self._dropNil()
+        if(fields is not None):
+            for key, value in (fields.iteritems() if isinstance(fields, dict) else fields):
+                self[key] = value
+
+    def __getitem__(self, key):
+        index = _arrayIndex(key)
+        if(self._array is not None and 0 < index <= len(self._array)):
+            return self._array[index - 1]
+        if(self._hash is None):
+            raise KeyError(key)
+        return self._hash[key]
+
+    def __setitem__(self, key, value):
+        if(value is None):
+            if(key in self):
+                del self[key]
+            return
+        index = _arrayIndex(key)
+        size = 0 if self._array is None else len(self._array)
+        if(0 < index <= size):
+            self._array[index - 1] = value
+        elif(index == size + 1):
+            if(self._hash is not None):
+                self._hash.pop(key, None)
+            self.append(value)
+        else:
+            if(self._hash is None):
+                self._hash = {}
+            self._hash[key] = value
+
+    def __delitem__(self, key):
+        index = _arrayIndex(key)
+        array = self._array
+        if(array is not None and 0 < index <= len(array)):
+            # Whatever followed the hole no longer is at 1 to n; it moves to
+            # the hash part.
+            if(index < len(array)):
+                if(self._hash is None):
+                    self._hash = {}
+                for i in xrange(index, len(array)):
+                    self._hash[i + 1] = array[i]
+            del array[index - 1:]
+            return
+        if(self._hash is None):
+            raise KeyError(key)
+        del self._hash[key]
+
+    def __contains__(self, key):
+        index = _arrayIndex(key)
+        if(self._array is not None and 0 < index <= len(self._array)):
+            return True
+        return self._hash is not None and key in self._hash
+
+    def __len__(self):
+        return (0 if self._array is None else len(self._array)) + \
+            (0 if self._hash is None else len(self._hash))
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __eq__(self, other):
+        if(isinstance(other, LuaTable)):
+            return (self._array or []) == (other._array or []) and \
+                (self._hash or {}) == (other._hash or {})
+        elif(isinstance(other, Mapping)):
+            return len(self) == len(other) and dict(self.iteritems()) == dict(other.iteritems())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return 'LuaTable(%r, %r)' % (self._array or [], self._hash or {})
+
+    def __reduce__(self):
+        return (LuaTable, (self._array, self._hash))
+
+    def append(self, value):
+        ''' Store value at key n + 1, n being the length of the array part,
+        and move the fields at the keys after it from the hash part to the
+        array part.
+        '''
+        if(value is None):
+            return
+        if(self._array is None):
+            self._array = []
+        self._array.append(value)
+        if(self._hash is not None):
+            self._grow()
+
+    def _dropNil(self):
+        # Cuts the array part at its first None, and moves the values after
+        # it to the hash part.
+        array = self._array
+        first = array.index(None)
+        for i in xrange(first + 1, len(array)):
+            if(array[i] is not None):
+                if(self._hash is None):
+                    self._hash = {}
+                self._hash[i + 1] = array[i]
+        del array[first:]
+
+    def _grow(self):
+        # Moves the fields at n + 1, n + 2, ... from the hash part to the
+        # array part.
+        array = self._array
+        fields = self._hash
+        while(len(fields) > 0 and len(array) + 1 in fields):
+            array.append(fields.pop(len(array) + 1))
+        if(len(fields) == 0):
+            self._hash = None
+
+    def border(self):
+        ''' Returns n, the length of the array part, which is what # gives
+        in Lua for a table without holes.
+        '''
+        return 0 if self._array is None else len(self._array)
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def copy(self):
+        ''' Returns a shallow copy.
+        '''
+        return LuaTable(None if self._array is None else self._array[:], \
+            None if self._hash is None else dict(self._hash))
+
+    def iterkeys(self):
+        if(self._array is not None):
+            for index in xrange(1, len(self._array) + 1):
+                yield index
+        if(self._hash is not None):
+            for key in self._hash:
+                yield key
+
+    def itervalues(self):
+        if(self._hash is None):
+            return iter(self._array or ())
+        return chain(self._array or (), self._hash.itervalues())
+
+    def iteritems(self):
+        if(self._array is None):
+            return iter(()) if self._hash is None else self._hash.iteritems()
+        items = enumerate(self._array, 1)
+        return items if self._hash is None else chain(items, self._hash.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def pop(self, key, *default):
+        if(key not in self):
+            if(default):
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    update = MutableMapping.update.im_func
+    setdefault = MutableMapping.setdefault.im_func
+
+    def popitem(self):
+        # Takes the last value of the array part, so that nothing moves to
+        # the hash part.
+        if(self._array):
+            value = self._array.pop()
+            return (len(self._array) + 1, value)
+        if(self._hash):
+            item = self._hash.popitem()
+            if(len(self._hash) == 0):
+                self._hash = None
+            return item
+        raise KeyError('popitem(): table is empty')
+
+    def clear(self):
+        self._array = None
+        self._hash = None
+
+MutableMapping.register(LuaTable)
+
+def _arrayIndex(key):
+    # The position key stands for in an array part, or 0 if none.
+    if(type(key) is int):
+        return key
+    elif(type(key) is float and key.is_integer() or type(key) is long):
+        return int(key)
+    return 0
+
+def _luaTable(table, hasNil):
+    # Finishes a table parsed into a LuaTable, whose values without key were
+    # appended to its array part, nil values included, and whose other fields
+    # are in its hash part. As in Lua, the values without key win over
+    # fields at the same keys.
+    items = table._array
+    fields = table._hash
+    if(fields is not None and len(items) > 0):
+        count = len(items)
+        for key in [key for key in fields if 0 < _arrayIndex(key) <= count]:
+            del fields[key]
+        if(len(fields) == 0):
+            table._hash = None
+    if(hasNil and None in items):
+        table._dropNil()
+    if(table._hash is not None and len(items) + 1 in table._hash):
+        table._grow()
+    if(len(items) == 0):
+        table._array = None
+    return table
+
+#----------lazy tables---------------------
+class _LazyTable(object):
+    ''' A subtable left unparsed by load(s, lazy = True). It keeps the text it
+    was found in and the offsets of its braces, s[start:end] being the table.
+    '''
+    __slots__ = ('text', 'start', 'end')
+
+    def __init__(self, text, start, end):
+        self.text = text
+        self.start = start
+        self.end = end
+
+    def parse(self):
+        ''' Returns a newly parsed list or dict for the subtable.
+        Throws LuaParseError when the subtable has grammar errors.
+        '''
+        parser = PyLuaTblParser()
+        parser._windows = _iterTokenWindows(self.text, self.start, self.end)
+        parser._tokens = parser._windows.next()
+        parser._pos = 0
+        return parser._nextTable()
+
+    def __deepcopy__(self, memo):
+        # dumpDict() copies the table; a freshly parsed subtable needs no copy.
+        return self.parse()
+
+#----------projection----------------------
+def _selectTree(select):
+    # The key paths in select as a tree of dicts: each key maps to the tree
+    # of the keys selected below it, or to None when its whole value is.
+    tree = {}
+    for path in select:
+        if(isinstance(path, basestring)):
+            path = [int(key) if key.isdigit() else key for key in path.split('.')]
+        node = tree
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+            if(node is None):
+                break
+        else:
+            node[path[-1]] = None
+    return tree
+
+def _subTree(tree, key):
+    # The tree of what is selected below key, None for all of it, False for
+    # nothing.
+    exact = tree.get(key, False)
+    wild = tree.get('*', False)
+    if(wild is False or exact is wild):
+        return exact
+    if(exact is False):
+        return wild
+    return _mergeTrees(exact, wild)
+
+def _mergeTrees(a, b):
+    if(a is None or b is None):
+        return None
+    result = dict(a)
+    for key, tree in b.iteritems():
+        if(key in result):
+            tree = _mergeTrees(result[key], tree)
+        result[key] = tree
+    return result
+
+# The token patterns, also taking the '=' or separator right after a token
+# when only whitespace is in between, which saves a match per field.
+_follow_pattern = r'''(?:[ \t\n\r\f\v]*(?P<follow>[=,;]))?'''
+_field_pattern = re.compile(_token_pattern.pattern + _follow_pattern, re.S | re.X)
+_deep_field_pattern = re.compile(_deep_token_pattern.pattern + _follow_pattern, re.S | re.X)
+
+def _projectText(s, tree):
+    if(_deep_bracket_pattern.search(s) is None):
+        lexer = (_token_pattern.match, _field_pattern.match, 1)
+    else:
+        lexer = (_deep_token_pattern.match, _deep_field_pattern.match, 2)
+    tokenMatch = lexer[0](s, 0)
+    if(tokenMatch.group(lexer[2]) != '{'):
+        raise LuaParseError(_unexpectedMessage('Expecting \'{\' when parsing table.', \
+            tokenMatch.group(lexer[2])))
+    return _projectTable(s, tokenMatch.end(), tree, lexer)[0]
+
+def _projectTable(s, pos, tree, lexer):
+    ''' Returns the fields selected by tree of the table whose '{' ends at
+    s[pos], and the offset after its '}'. The table is read field by field as
+    in _nextTable, but only selected values are parsed, other subtables being
+    skipped by _skipTable().
+    '''
+    (match, fieldMatch, group) = lexer
+    fields = []
+    arrayIndex = 1
+    hasKey = False
+    while True:
+        tokenMatch = fieldMatch(s, pos)
+        token = tokenMatch.group(group)
+        if(token == '}'):
+            pos = tokenMatch.end(group)
+            break
+        isIndex = False
+        key = None
+        if(token == '['):
+            tokenMatch = match(s, tokenMatch.end(group))
+            key = PyLuaTblParser._asIndex(tokenMatch.group(group))
+            tokenMatch = match(s, tokenMatch.end())
+            if(tokenMatch.group(group) != ']'):
+                raise LuaParseError(_unexpectedMessage('Expecting \']\' after index.', \
+                    tokenMatch.group(group)))
+            tokenMatch = match(s, tokenMatch.end())
+            if(tokenMatch.group(group) != '='):
+                raise LuaParseError(_unexpectedMessage('Expecting \'=\' after table index.', \
+                    tokenMatch.group(group)))
+            isIndex = True
+            tokenMatch = fieldMatch(s, tokenMatch.end())
+        elif(len(token) == 0):
+            raise LuaParseError(_unexpectedMessage('Expecting \'}\' when parsing table.', token))
+        elif(token != '{'):
+            follow = tokenMatch.group('follow')
+            if(follow is None):
+                following = match(s, tokenMatch.end(group))
+                if(following.group(group) == '='):
+                    follow = '='
+                    tokenMatch = following
+            if(follow == '='):
+                key = PyLuaTblParser._asName(token)
+                tokenMatch = fieldMatch(s, tokenMatch.end())
+        token = tokenMatch.group(group)
+        follow = tokenMatch.group('follow')
+
+        if(key is None):
+            index = arrayIndex
+            arrayIndex += 1
+            subTree = _subTree(tree, index - 1)
+            if(subTree is not _subTree(tree, index)):
+                # Which one applies is only known at the end of the table,
+                # once it is known whether it is a list.
+                subTree = _PENDING
+        else:
+            hasKey = True
+            index = None
+            subTree = _subTree(tree, key)
+            # Fields load() does not store do not replace an earlier value;
+            # any other field does, even where nothing of it is selected.
+            if(token == 'nil' or isIndex and isinstance(key, int) and key < arrayIndex):
+                index = False
+        if(token == '{'):
+            if(isinstance(subTree, dict)):
+                (value, pos) = _projectTable(s, tokenMatch.end(group), subTree, lexer)
+            else:
+                start = tokenMatch.start(group)
+                pos = _skipTable(s, tokenMatch.end(group))
+                value = (start, pos)
+            follow = None
+        else:
+            value = token
+            if(follow is None):
+                pos = tokenMatch.end(group)
+            else:
+                pos = tokenMatch.end()
+        if(index is not False):
+            fields.append((key, index, subTree, value))
+
+        if(follow is None):
+            tokenMatch = match(s, pos)
+            follow = tokenMatch.group(group)
+            if(follow == ',' or follow == ';'):
+                pos = tokenMatch.end()
+            elif(follow != '}'):
+                raise LuaParseError(_unexpectedMessage( \
+                    'Expecting \',\' or \';\' when seeking for next field separator.', follow))
+        elif(follow == '='):
+            raise LuaParseError(_unexpectedMessage( \
+                'Expecting \',\' or \';\' when seeking for next field separator.', follow))
+
+    if(hasKey):
+        result = {}
+        for (key, index, subTree, value) in fields:
+            if(key is None):
+                key = index
+                if(subTree is _PENDING):
+                    subTree = _subTree(tree, key)
+            value = _projectValue(s, value, subTree, lexer)
+            if(value is _UNSELECTED):
+                result.pop(key, None)
+            else:
+                result[key] = value
+        PyLuaTblParser._clearNilKey(result)
+    else:
+        result = []
+        for (key, index, subTree, value) in fields:
+            if(subTree is _PENDING):
+                subTree = _subTree(tree, index - 1)
+            value = _projectValue(s, value, subTree, lexer)
+            if(value is not _UNSELECTED):
+                result.append(value)
+    return (result, pos)
+
+_PENDING = object()
+_UNSELECTED = object()
+
+def _projectValue(s, value, tree, lexer):
+    # The selected part of a field value as _projectTable() found it: a
+    # token, the offsets of a skipped table or an already projected table.
+    if(tree is False):
+        return _UNSELECTED
+    if(isinstance(value, tuple)):
+        if(tree is None):
+            return _LazyTable(s, value[0], value[1]).parse()
+        return _projectTable(s, value[0] + 1, tree, lexer)[0]
+    if(isinstance(value, basestring)):
+        if(tree is None):
+            return _parseValue(value)
+        # A path going on below a value that is no table selects nothing.
+        return _UNSELECTED
+    return value
+
+#----------incremental parsing-------------
+def _outerSpan(text):
+    # Offsets of the braces of the outermost table, text[start:end] being it.
+    if(_deep_bracket_pattern.search(text) is None):
+        (match, group) = (_token_pattern.match(text), 1)
+    else:
+        (match, group) = (_deep_token_pattern.match(text), 2)
+    start = match.start(group)
+    return (start, _skipTable(text, start + 1))
+
+class _Spans(object):
+    ''' Where the subtables of the table text[start:end] are, for edit():
+    the offsets of their braces relative to start, sorted, and their keys.
+    children holds the _Spans of those subtables that edits fell in.
+    '''
+    __slots__ = ('starts', 'ends', 'keys', 'children')
+
+    def __init__(self, text, start, end):
+        parser = PyLuaTblParser()
+        (parser._tokens, parser._tables) = _outerTokens(buffer(text, start, end - start))
+        parser._pos = 0
+        table = parser._nextLazyTable()
+        if(isinstance(table, dict)):
+            items = table.iteritems()
+        else:
+            items = enumerate(table)
+        fields = sorted([(value.start, value.end, key) for key, value in items \
+            if isinstance(value, _LazyTable)])
+        self.starts = [field[0] for field in fields]
+        self.ends = [field[1] for field in fields]
+        self.keys = [field[2] for field in fields]
+        self.children = {}
+
+    def shift(self, index, delta):
+        ''' Account for delta characters more inside subtable index.
+        '''
+        self.ends[index] += delta
+        if(delta != 0 and index + 1 < len(self.starts)):
+            self.starts[index + 1:] = [start + delta for start in self.starts[index + 1:]]
+            self.ends[index + 1:] = [end + delta for end in self.ends[index + 1:]]
+
+#----------diff and patch------------------
+def _tableItem(table, key):
+    # table[key], with a subtable left by a lazy load parsed in place.
+    value = table[key]
+    if(isinstance(value, _LazyTable)):
+        value = value.parse()
+        table[key] = value
+    return value
+
+def _isFields(value):
+    # Whether merge() merges value into a table rather than storing it.
+    return isinstance(value, dict) or isinstance(value, _TableView) or isinstance(value, LuaTable)
+
+def _sameValue(a, b):
+    return a is b or type(a) == type(b) and a == b
+
+def _diffTables(new, old):
+    ''' Returns the operations that turn old into new, see
+    PyLuaTblParser.diff().
+    '''
+    operations = []
+    stack = []
+    _diffValues(operations, stack, [], new, old)
+    while(len(stack) > 0):
+        (path, new, old) = stack.pop()
+        if(isinstance(new, dict) or isinstance(new, LuaTable)):
+            for key in old:
+                if(key not in new):
+                    operations.append({'op': 'delete', 'path': path + [key]})
+            for key in new:
+                if(key in old):
+                    _diffValues(operations, stack, path + [key], _tableItem(new, key), _tableItem(old, key))
+                else:
+                    operations.append({'op': 'set', 'path': path + [key], 'value': PyLuaTblParser._loadValue(new[key])})
+            continue
+
+        # Lists: the items that differ are those between the longest common
+        # prefix and suffix. If both lists are as long, they are compared one
+        # by one, otherwise replaced by a single splice.
+        count = min(len(new), len(old))
+        first = 0
+        while(first < count and _sameValue(_tableItem(new, first), _tableItem(old, first))):
+            first += 1
+        last = 0
+        while(last < count - first and \
+            _sameValue(_tableItem(new, len(new) - 1 - last), _tableItem(old, len(old) - 1 - last))):
+            last += 1
+        if(len(new) == len(old)):
+            for index in xrange(first, len(new) - last):
+                _diffValues(operations, stack, path + [index], new[index], old[index])
+        else:
+            operations.append({'op': 'splice', 'path': path, 'index': first, \
+                'delete': len(old) - last - first, 'insert': PyLuaTblParser._loadValue(new[first:len(new) - last])})
+    return operations
+
+def _diffValues(operations, stack, path, new, old):
+    if(_sameValue(new, old)):
+        return
+    if(isinstance(new, dict) and isinstance(old, dict) or isinstance(new, list) and isinstance(old, list) or \
+        isinstance(new, LuaTable) and isinstance(old, LuaTable)):
+        stack.append((path, new, old))
+    else:
+        operations.append({'op': 'set', 'path': path, 'value': PyLuaTblParser._loadValue(new)})
+
+#----------shared tables-------------------
+# Values told apart by identity in signatures. LuaTables are not shared, but
+# cannot be hashed either.
+_table_types = frozenset([dict, list, array, LuaTable])
+
+def _tableSignature(table):
+    # Equal for tables that are equal field by field and type by type, so
+    # that 1, 1.0 and true differ, with subtables told apart by identity, as
+    # equal ones are shared already. The sign of floats tells 0.0 and -0.0
+    # apart, which are equal too.
+    tableTypes = _table_types
+    if(isinstance(table, array)):
+        return (array, table.typecode, table.tostring())
+    elif(isinstance(table, list)):
+        return (list, tuple([(type(value), id(value) if type(value) in tableTypes else value, \
+            type(value) is float and copysign(1.0, value)) for value in table]))
+    return (dict, frozenset([(type(key), key, type(value), id(value) if type(value) in tableTypes else value, \
+        type(value) is float and copysign(1.0, value)) for key, value in table.iteritems()]))
+
+def _pooledTable(tables, table):
+    # The table in tables equal to table, or table after adding it. tables
+    # maps the hash of a signature to a table, so that the signatures of all
+    # the tables need not be kept; tables whose hashes collide are not
+    # shared, nor are tables holding values that cannot be hashed, which
+    # loadDict() may be given.
+    try:
+        signature = _tableSignature(table)
+        key = hash(signature)
+    except TypeError:
+        return table
+    pooled = tables.get(key)
+    if(pooled is None):
+        tables[key] = table
+        return table
+    elif(pooled is table or _tableSignature(pooled) == signature):
+        return pooled
+    return table
+
+def _dedupTables(table, tables):
+    # Replaces the subtables of table, which shares none yet, by the ones in
+    # tables equal to them, innermost first and without recursion.
+    if(not (isinstance(table, dict) or isinstance(table, list))):
+        return
+    stack = [(table, _tableKeys(table), None)]
+    while(len(stack) > 0):
+        (parent, keys, parentKey) = stack[-1]
+        for key in keys:
+            value = parent[key]
+            if(isinstance(value, dict) or isinstance(value, list)):
+                stack.append((value, _tableKeys(value), key))
+                break
+            elif(isinstance(value, array)):
+                parent[key] = _pooledTable(tables, value)
+        else:
+            stack.pop()
+            if(len(stack) > 0):
+                stack[-1][0][parentKey] = _pooledTable(tables, parent)
+
+def _tableKeys(table):
+    return iter(table.keys() if isinstance(table, dict) else xrange(len(table)))
+
+#----------snapshots-----------------------
+def _view(value):
+    if(isinstance(value, dict) or isinstance(value, LuaTable)):
+        return _TableView(value)
+    elif(isinstance(value, list) or isinstance(value, array)):
+        return _ListView(value)
+    return value
+
+class _TableView(Mapping):
+    ''' Read-only view of a dict returned by PyLuaTblParser.snapshot().
+    '''
+    __slots__ = ('_table',)
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, key):
+        value = self._table[key]
+        if(isinstance(value, _LazyTable)):
+            # Storing the parsed table changes nothing a reader can see.
+            value = value.parse()
+            self._table[key] = value
+        return _view(value)
+
+    def __iter__(self):
+        return iter(self._table)
+
+    def __len__(self):
+        return len(self._table)
+
+    def __contains__(self, key):
+        return key in self._table
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __reduce__(self):
+        return (_TableView, (self._table,))
+
+class _ListView(Sequence):
+    ''' Read-only view of a list returned by PyLuaTblParser.snapshot().
+    '''
+    __slots__ = ('_table',)
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, index):
+        if(isinstance(index, slice)):
+            return _ListView(self._table[index])
+        value = self._table[index]
+        if(isinstance(value, _LazyTable)):
+            value = value.parse()
+            self._table[index] = value
+        return _view(value)
+
+    def __len__(self):
+        return len(self._table)
+
+    def __eq__(self, other):
+        if(not (isinstance(other, list) or isinstance(other, _ListView))):
+            return NotImplemented
+        return len(self) == len(other) and all([a == b for a, b in zip(self, other)])
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if(equal is NotImplemented):
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        return (_ListView, (self._table,))
+
+#----------copy on write-------------------
+def _isTable(value):
+    return isinstance(value, dict) or isinstance(value, list) or isinstance(value, array) or \
+        isinstance(value, LuaTable)
+
+def _tableCopy(table):
+    # A copy of table that shares its subtables.
+    if(isinstance(table, dict)):
+        return dict(table)
+    elif(isinstance(table, LuaTable)):
+        return table.copy()
+    return table[:]
+
+def _proxy(owner, parent, key, value):
+    if(isinstance(value, dict) or isinstance(value, LuaTable)):
+        return _TableProxy(owner, parent, key, value)
+    elif(isinstance(value, list) or isinstance(value, array)):
+        return _ListProxy(owner, parent, key, value)
+    return value
+
+class _Proxy(object):
+    ''' What _TableProxy and _ListProxy share. A proxy stands for the table
+    under key in the table its parent proxy stands for, or in the outermost
+    table of owner if parent is None. It reads the table it was made for
+    until it or another proxy for the same field changes it: the first
+    change copies the table and the tables on the way to it that the owner
+    does not own yet, and puts the copies in their place. Once the field
+    holds another table, or the owner has loaded another one, the proxy is
+    detached: it keeps the table it had, as a dict or list handed out without
+    a snapshot would, and copies it before it is changed.
+    '''
+    __slots__ = ()
+
+    def _current(self):
+        # The table to read, which another proxy may have copied since.
+        table = self._target
+        owned = self._owner._ownTables
+        if(owned is not None and id(table) in owned):
+            return table
+        if(self._parent is None):
+            owner = self._owner
+            if(owner._ownTables is not self._owned):
+                self._detach()
+                return table
+            parent = owner._dict
+        else:
+            parent = self._parent._current()
+            # The parent may have been detached since this proxy was made.
+            owner = self._owner = self._parent._owner
+            self._owned = self._parent._owned
+        try:
+            current = parent[self._key]
+        except (KeyError, IndexError, TypeError):
+            current = None
+        if(current is table):
+            return table
+        # Copies of copies are made after later snapshots.
+        copies = owner._copies
+        copied = copies.get(id(table))
+        for i in xrange(len(copies)):
+            if(copied is None):
+                break
+            if(copied == id(current)):
+                self._target = current
+                return current
+            copied = copies.get(copied)
+        self._detach()
+        return self._target
+
+    def _detach(self):
+        self._owner = _DetachedOwner(self._target)
+        self._owned = self._owner._ownTables
+        self._parent = None
+        self._key = 0
+
+    def _own(self):
+        # The table to change, copied first if it may be shared.
+        table = self._current()
+        owner = self._owner
+        owned = owner._ownTables
+        if(id(table) in owned):
+            return table
+        if(self._parent is None):
+            owner._unshare()
+            parent = owner._dict
+        else:
+            parent = self._parent._own()
+        copy = _tableCopy(table)
+        parent[self._key] = copy
+        owned[id(copy)] = copy
+        owner._copies[id(table)] = id(copy)
+        self._target = copy
+        return copy
+
+    # Where the views keep their table, for the code that unwraps them.
+    _table = property(_current)
+
+class _DetachedOwner(object):
+    # Owns the table of a detached proxy in place of the parser, in a list
+    # of its own. The table may still be shared with a snapshot.
+    __slots__ = ('_dict', '_ownTables', '_copies')
+
+    def __init__(self, table):
+        self._dict = [table]
+        self._ownTables = {}
+        self._copies = {}
+
+    def _unshare(self):
+        pass
+
+def _ownValue(value):
+    # value as it is stored through a proxy: snapshots and proxies are
+    # copied, as what they show may change.
+    if(isinstance(value, _TableView) or isinstance(value, _ListView)):
+        return PyLuaTblParser._loadValue(value)
+    return value
+
+class _TableProxy(_Proxy, _TableView, MutableMapping):
+    ''' Copy-on-write stand-in for a dict or LuaTable that [] hands out while
+    a snapshot, or other fields after a dedup load, may share it.
+    '''
+    __slots__ = ('_owner', '_owned', '_parent', '_key', '_target')
+
+    def __init__(self, owner, parent, key, table):
+        self._owner = owner
+        self._owned = owner._ownTables
+        self._parent = parent
+        self._key = key
+        self._target = table
+
+    def __getitem__(self, key):
+        value = self._current()[key]
+        return _proxy(self._owner, self, key, value)
+
+    def __setitem__(self, key, value):
+        self._own()[key] = _ownValue(value)
+
+    def __delitem__(self, key):
+        del self._own()[key]
+
+    def __reduce__(self):
+        return (dict, (PyLuaTblParser._loadValue(self),))
+
+class _ListProxy(_Proxy, _ListView, MutableSequence):
+    ''' Copy-on-write stand-in for a list or array that [] hands out while a
+    snapshot, or other fields after a dedup load, may share it.
+    '''
+    __slots__ = ('_owner', '_owned', '_parent', '_key', '_target')
+
+    def __init__(self, owner, parent, key, table):
+        self._owner = owner
+        self._owned = owner._ownTables
+        self._parent = parent
+        self._key = key
+        self._target = table
+
+    def __getitem__(self, index):
+        if(isinstance(index, slice)):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        table = self._current()
+        if(index < 0):
+            index += len(table)
+        value = table[index]
+        return _proxy(self._owner, self, index, value)
+
+    def __setitem__(self, index, value):
+        if(isinstance(index, slice)):
+            value = map(_ownValue, value)
+        else:
+            value = _ownValue(value)
+        self._own()[index] = value
+
+    def __delitem__(self, index):
+        del self._own()[index]
+
+    def insert(self, index, value):
+        self._own().insert(index, _ownValue(value))
+
+    def append(self, value):
+        self._own().append(_ownValue(value))
+
+    def __reduce__(self):
+        return (list, (PyLuaTblParser._loadValue(self),))
+
+#----------batch loading-------------------
+# Files are sent to the workers in batches of about this many bytes, or
+# smaller when there would otherwise be too few batches to keep every worker
+# busy, so that small files do not cost a round trip each.
+_BATCH_BYTES = 1024 * 1024
+_BATCHES_PER_WORKER = 4
+
+def load_many(paths, workers = None):
+    ''' Load the Lua table files in paths, using a pool of workers processes
+    (one per CPU by default). A file that fails to parse does not stop the
+    others.
+    Returns (tables, errors): tables holds what dumpDict() would return for
+    each file, in the order of paths, or None for a file that failed, and
+    errors maps the index in paths of each such file to its LuaParseError.
+    Throws OSError when a path does not name a file, before any file is
+    loaded, as the files are split among the workers by size; IOError when a
+    file cannot be read; and ValueError when workers is less than 1.
+    '''
+    paths = list(paths)
+    if(workers is None):
+        workers = cpu_count()
+    _checkWorkers(workers)
+    batches = _batchFiles(paths, workers)
+    if(workers <= 1 or len(batches) <= 1):
+        results = map(_loadFiles, batches)
+    else:
+        pool = Pool(min(workers, len(batches)))
+        try:
+            results = pool.map(_loadFiles, batches, 1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    tables = []
+    errors = {}
+    for result in results:
+        for table, error in result:
+            if(error is not None):
+                errors[len(tables)] = error
+            tables.append(table)
+    return (tables, errors)
+
+def _checkWorkers(workers):
+    if(workers is not None and workers < 1):
+        raise ValueError('workers must be at least 1, not ' + str(workers) + '.')
+
+def _checkLoadArguments(lazy, editable, select, arrays, internStrings, luaTables, dedup, workers):
+    # load() refuses what it could not do rather than ignore some of it.
+    _checkWorkers(workers)
+    ways = [name for (name, used) in [('select', select is not None), ('lazy', lazy), \
+        ('editable', editable), ('workers', workers is not None)] if used]
+    options = [name for (name, used) in [('arrays', arrays), \
+        ('intern_strings', internStrings is not False and internStrings is not None), \
+        ('lua_tables', luaTables), ('dedup', dedup)] if used]
+    if(len(ways) > 0 and len(options) > 0):
+        raise ValueError(ways[0] + ' cannot be combined with ' + options[0] + '.')
+    if(ways[:1] == ['select'] and len(ways) > 1 or 'lazy' in ways and 'workers' in ways):
+        raise ValueError(ways[0] + ' cannot be combined with ' + ways[-1] + '.')
+    if(luaTables and dedup):
+        raise ValueError('dedup cannot be combined with lua_tables.')
+
+def _batchFiles(paths, workers):
+    # Splits paths into runs of consecutive files of about equal total size.
+    sizes = [os.path.getsize(path) for path in paths]
+    batchBytes = min(_BATCH_BYTES, sum(sizes) // (workers * _BATCHES_PER_WORKER) + 1)
+    batches = []
+    batch = []
+    size = 0
+    for path, pathSize in zip(paths, sizes):
+        batch.append(path)
+        size += pathSize
+        if(size >= batchBytes):
+            batches.append(batch)
+            batch = []
+            size = 0
+    if(len(batch) > 0):
+        batches.append(batch)
+    return batches
+
+def _loadFiles(paths):
+    # Runs in a worker: returns a (table, error) pair per file.
+    results = []
+    parser = PyLuaTblParser()
+    for path in paths:
+        try:
+            parser.loadLuaTable(path)
+            results.append((parser._dict, None))
+        except LuaParseError, e:
+            results.append((None, e))
+        parser._dict = {}
+    return results
+
+def _fieldBatches(s, tables, workers):
+    # Yields runs of consecutive subtables out of tables, the _LazyTables of
+    # the outermost table, as the text from the first to the last one and
+    # their number, about equally long so that every worker gets several.
+    indexes = sorted(tables)
+    if(len(indexes) == 0):
+        return
+    size = tables[indexes[-1]].end - tables[indexes[0]].start
+    batchBytes = min(_BATCH_BYTES, size // (workers * _BATCHES_PER_WORKER) + 1)
+    start = None
+    count = 0
+    for index in indexes:
+        table = tables[index]
+        if(start is None):
+            start = table.start
+        count += 1
+        if(table.end - start >= batchBytes):
+            yield (s[start:table.end], count)
+            start = None
+            count = 0
+    if(count > 0):
+        yield (s[start:table.end], count)
+
+def _iterFieldTables(batches, workers):
+    # The tables of batches in order; as for iterload(), at most
+    # _BATCHES_PER_WORKER batches per worker are in flight.
+    if(workers <= 1):
+        for batch in batches:
+            for table in _loadedTables(_loadFieldTables(batch)):
+                yield table
+        return
+    pool = Pool(workers)
+    pending = deque()
+    try:
+        for batch in batches:
+            pending.append(pool.apply_async(_loadFieldTables, (batch,)))
+            if(len(pending) >= workers * _BATCHES_PER_WORKER):
+                for table in _loadedTables(pending.popleft().get()):
+                    yield table
+        pool.close()
+        while(len(pending) > 0):
+            for table in _loadedTables(pending.popleft().get()):
+                yield table
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _loadFieldTables(batch):
+    # Runs in a worker: the count tables in text in order, skipping the
+    # tokens of the outermost table between them, followed by the
+    # LuaParseError of the first one that fails to parse, if any.
+    (text, count) = batch
+    results = []
+    parser = PyLuaTblParser()
+    windows = _iterTokenWindows(text, 0, len(text))
+    parser._windows = windows
+    tokens = windows.next()
+    index = 0
+    try:
+        while(len(results) < count):
+            if(index == len(tokens)):
+                tokens = windows.next()
+                index = 0
+            if(tokens[index] != '{'):
+                index += 1
+                continue
+            parser._tokens = tokens
+            parser._pos = index
+            results.append(parser._nextTable())
+            (tokens, index) = (parser._tokens, parser._pos)
+    except LuaParseError, e:
+        results.append(e)
+    return results
+
+#----------binary format-------------------
+# A binary table is a header followed by the table in marshal format, which
+# tags every value, prefixes strings and tables with their length and writes
+# interned strings only once, referring back to them afterwards. The header
+# holds the version of both.
+_BINARY_MAGIC = '\0LuaTbl'
+_BINARY_VERSION = 1
+_MARSHAL_VERSION = 2
+_BINARY_HEADER = _BINARY_MAGIC + chr(_BINARY_VERSION) + chr(_MARSHAL_VERSION)
+_INTERN_LENGTH = 32
+# marshal loads tuples, sets, complex numbers and code objects as well, none
+# of which a table holds. Lists hold None for nil.
+_BINARY_KEY_TYPES = frozenset([str, unicode, int, long, float])
+_BINARY_VALUE_TYPES = _BINARY_KEY_TYPES | frozenset([bool, type(None), dict, list])
+
+def _isBinaryTable(table):
+    # Whether table, as loaded by marshal, holds nothing but what dumpBinary()
+    # writes.
+    if(type(table) is not dict and type(table) is not list):
+        return False
+    stack = [table]
+    while(len(stack) > 0):
+        table = stack.pop()
+        if(type(table) is dict):
+            for key in table:
+                if(type(key) not in _BINARY_KEY_TYPES):
+                    return False
+            values = table.itervalues()
+        else:
+            values = table
+        for value in values:
+            valueType = type(value)
+            if(valueType not in _BINARY_VALUE_TYPES):
+                return False
+            if(valueType is dict or valueType is list):
+                stack.append(value)
+    return True
+
+def _internedCopy(table):
+    # Copy of table with its keys and short strings interned, so that repeated
+    # ones are written once. Lazy tables are parsed on the way.
+    copy = _internedValue(table, [])
+    stack = [(table, copy)]
+    while(len(stack) > 0):
+        (source, target) = stack.pop()
+        if(isinstance(target, dict)):
+            for key, value in source.iteritems():
+                if(type(key) is str):
+                    key = intern(key)
+                target[key] = _internedValue(value, stack)
+        else:
+            for value in source:
+                target.append(_internedValue(value, stack))
+    return copy
+
+def _internedValue(value, stack):
+    if(isinstance(value, _LazyTable)):
+        value = value.parse()
+    if(isinstance(value, dict)):
+        copy = {}
+    elif(isinstance(value, list)):
+        copy = []
+    elif(isinstance(value, array)):
+        # marshal cannot write arrays; they load back as lists.
+        return value.tolist()
+    elif(isinstance(value, LuaTable)):
+        # Nor LuaTables; they load back as the list or dict they would be.
+        if(value._hash is None):
+            copy = []
+            stack.append((value._array or (), copy))
+        else:
+            copy = {}
+            stack.append((value, copy))
+        return copy
+    elif(type(value) is str and len(value) <= _INTERN_LENGTH):
+        return intern(value)
+    else:
+        return value
+    stack.append((value, copy))
+    return copy
+
+#----------parse cache---------------------
+_CACHE_BYTES = 64 * 1024 * 1024
+
+class ParseCache(object):
+    ''' Cache of parsed tables for PyLuaTblParser.load() and loadLuaTable(),
+    which take it as their cache argument. Files are looked up by path and
+    their modification time and size, texts by a SHA-1 hash of their
+    contents, so changed files and texts are never taken from the cache.
+    Tables are kept marshalled, least recently used ones being dropped first
+    once they take more than max_bytes. If directory is given, they are also
+    stored there, one file each, and read back from it when not in memory,
+    so the cache survives restarts.
+    hits and misses count the lookups that found a table and that did not.
+    '''
+    def __init__(self, max_bytes = _CACHE_BYTES, directory = None):
+        self.hits = 0
+        self.misses = 0
+        self._maxBytes = max_bytes
+        self._directory = directory
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def clear(self):
+        ''' Drop the tables kept in memory. Files in directory are kept.
+        '''
+        self._entries.clear()
+        self._bytes = 0
+
+    def _get(self, name, stamp):
+        # Returns a new copy of the table stored under name with the same
+        # stamp, or None.
+        entry = self._entries.pop(name, None)
+        if(entry is not None):
+            self._bytes -= len(entry[1])
+        elif(self._directory is not None):
+            entry = self._read(name)
+        if(entry is None or entry[0] != stamp):
+            self.misses += 1
+            return None
+        self._add(name, entry)
+        self.hits += 1
+        return marshal.loads(entry[1])
+
+    def _put(self, name, stamp, table):
+        try:
+            data = marshal.dumps(table)
+        except ValueError:
+            # Nested too deeply for marshal.
+            return
+        entry = (stamp, data)
+        if(self._directory is not None):
+            try:
+                self._write(name, entry)
+            except EnvironmentError:
+                # The table is still cached in memory.
+                pass
+        self._add(name, entry)
+
+    def _add(self, name, entry):
+        self._entries[name] = entry
+        self._bytes += len(entry[1])
+        while(self._bytes > self._maxBytes):
+            (name, entry) = self._entries.popitem(False)
+            self._bytes -= len(entry[1])
+
+    def _path(self, name):
+        if(isinstance(name, unicode)):
+            name = name.encode('utf-8')
+        return os.path.join(self._directory, hashlib.sha1(name).hexdigest() + '.marshal')
+
+    def _read(self, name):
+        try:
+            infile = open(self._path(name), 'rb')
+        except EnvironmentError:
+            return None
+        try:
+            try:
+                return (marshal.load(infile), infile.read())
+            except (EOFError, ValueError, TypeError):
+                return None
+        finally:
+            infile.close()
+
+    def _write(self, name, entry):
+        # Written to a temporary file first so that a reader never sees half
+        # of an entry.
+        (fd, tempPath) = tempfile.mkstemp(dir = self._directory)
+        outfile = os.fdopen(fd, 'wb')
+        try:
+            marshal.dump(entry[0], outfile)
+            outfile.write(entry[1])
+        finally:
+            outfile.close()
+        os.rename(tempPath, self._path(name))
+
+#----------string pools--------------------
+_POOL_STRINGS = 64 * 1024
+
+class StringPool(object):
+    ''' Strings shared by the tables loaded with it, for load() and
+    loadLuaTable(), which take it as their intern_strings argument. Names
+    used as keys and strings of at most max_length characters are kept once,
+    interned like the names in a program, up to max_strings of them; other
+    strings, and unicode strings, are left as they are. A pool keeps its
+    strings alive until it is cleared or dropped.
+    len() tells how many strings it holds and saved_bytes about how much
+    memory the copies it saved would take.
+    '''
+    def __init__(self, max_strings = _POOL_STRINGS, max_length = _INTERN_LENGTH):
+        self._strings = _StringTable(max_strings, max_length)
+
+    def __len__(self):
+        return len(self._strings)
+
+    @property
+    def saved_bytes(self):
+        # Every reference beyond the table's own two, the loop's and the one
+        # getrefcount() takes, is a use of the string that needs no copy.
+        saved = 0
+        getrefcount = sys.getrefcount
+        getsizeof = sys.getsizeof
+        for s in self._strings:
+            uses = getrefcount(s) - 4
+            if(uses > 1):
+                saved += (uses - 1) * getsizeof(s)
+        return saved
+
+    def clear(self):
+        self._strings.clear()
+
+class _StringTable(dict):
+    # Looked up with [] while loading; a string not in it yet is added if
+    # there is room for it.
+    __slots__ = ('maxStrings', 'maxLength')
+
+    def __init__(self, maxStrings, maxLength):
+        dict.__init__(self)
+        self.maxStrings = maxStrings
+        self.maxLength = maxLength
+
+    def __missing__(self, s):
+        # intern() takes str only, and a unicode string kept here would come
+        # back for an equal str.
+        if(type(s) is not str or len(s) > self.maxLength or len(self) >= self.maxStrings):
+            return s
+        s = intern(s)
+        self[s] = s
+        return s
+
+#----------instrumentation-----------------
+_INSTRUMENTED = ('load', 'dump', 'loadDict', 'dumpDict')
+
+class ParserStats(object):
+    ''' What one call of an instrumented PyLuaTblParser took, see instrument():
+        operation         'load', 'dump', 'loadDict' or 'dumpDict'
+        seconds           time the call took, instrumentation left out
+        phases            seconds by phase. For load(): 'lex', 'decode' for
+                          values that need more than int() or stripping
+                          quotes, 'clear_nil' and 'build' for the rest; the
+                          plain values are converted while building. For
+                          dump(): 'dump', and for the others: 'copy'
+        tokens            for load(), the number of tokens by type: 'symbol',
+                          'name', 'number' and 'string'
+        bytes             length of the text loaded or dumped, or 0
+        bytes_per_second  bytes / seconds
+        max_depth         nesting depth of the table
+        tables, values    how many tables and other values it holds
+    Lazy, cached and selective loads only count the tokens of, and time the
+    lexing of, the text they actually parse.
+    '''
+    def __init__(self, operation):
+        self.operation = operation
+        self.seconds = 0.0
+        if(operation == 'load'):
+            self.phases = {'lex': 0.0, 'decode': 0.0, 'clear_nil': 0.0, 'build': 0.0}
+            self.tokens = {'symbol': 0, 'name': 0, 'number': 0, 'string': 0}
+        else:
+            self.phases = {('dump' if operation == 'dump' else 'copy'): 0.0}
+            self.tokens = {}
+        self.bytes = 0
+        self.bytes_per_second = 0.0
+        self.max_depth = 0
+        self.tables = 0
+        self.values = 0
+        self._overhead = 0.0
+
+    def __repr__(self):
+        return '<ParserStats %s %.6fs %r>' % (self.operation, self.seconds, self.phases)
+
+    def _watch(self, windows):
+        # Passes the token windows on, timing the lexing and counting tokens.
+        nextWindow = windows.next
+        phases = self.phases
+        counts = self.tokens
+        kinds = {_CHAR_NAME: 'name', _CHAR_NUMBER: 'number', _CHAR_STRING: 'string', \
+            _CHAR_BRACKET: 'string'}
+        while True:
+            start = time.time()
+            try:
+                tokens = nextWindow()
+            except StopIteration:
+                return
+            lexed = time.time()
+            phases['lex'] += lexed - start
+            for token in tokens:
+                if(token in _symbols):
+                    counts['symbol'] += 1
+                elif(_char_kinds.get(token[:1]) in kinds):
+                    counts[kinds[_char_kinds[token[0]]]] += 1
+            self._overhead += time.time() - lexed
+            yield tokens
+
+    def _timed(self, phase, function):
+        phases = self.phases
+        def timed(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                phases[phase] += time.time() - start
+        return timed
+
+    def _finish(self, seconds, size, table):
+        self.seconds = max(0.0, seconds - self._overhead)
+        self.bytes = size
+        if(self.seconds > 0):
+            self.bytes_per_second = size / self.seconds
+        if(self.operation == 'load'):
+            phases = self.phases
+            phases['build'] = max(0.0, self.seconds - phases['lex'] - phases['decode'] - \
+                phases['clear_nil'])
+        else:
+            self.phases[self.phases.keys()[0]] = self.seconds
+        # Walked without recursion, as tables may nest deeper than the stack.
+        stack = [(table, 1)]
+        while(len(stack) > 0):
+            (value, depth) = stack.pop()
+            if(isinstance(value, dict) or isinstance(value, LuaTable)):
+                value = value.itervalues()
+            elif(isinstance(value, array)):
+                self.tables += 1
+                self.values += len(value)
+                self.max_depth = max(self.max_depth, depth)
+                continue
+            elif(not isinstance(value, list)):
+                self.values += 1
+                continue
+            self.tables += 1
+            self.max_depth = max(self.max_depth, depth)
+            stack.extend([(item, depth + 1) for item in value])
+
+def _instrumented(parser, name, callback):
+    # Returns a stand-in for the method name of parser that fills in a
+    # ParserStats around it. Calls made from within it are not counted apart.
+    method = getattr(PyLuaTblParser, name)
+    def call(*args, **kwargs):
+        if(parser._stats is not None):
+            return method(parser, *args, **kwargs)
+        stats = ParserStats(name)
+        parser._stats = stats
+        if(name == 'load'):
+            parser._parseValue = stats._timed('decode', _parseValue)
+            parser._clearNilKey = stats._timed('clear_nil', PyLuaTblParser._clearNilKey)
+        start = time.time()
+        try:
+            result = method(parser, *args, **kwargs)
+        finally:
+            seconds = time.time() - start
+            parser._stats = None
+            if(name == 'load'):
+                del parser._parseValue
+                del parser._clearNilKey
+        if(name == 'load'):
+            size = len(args[0] if len(args) > 0 else kwargs['s'])
+        elif(name == 'dump'):
+            size = len(result)
+        else:
+            size = 0
+        stats._finish(seconds, size, parser._dict)
+        parser.stats = stats
+        if(callback is not None):
+            callback(stats)
+        return result
+    return call
+
+#----------streaming parser----------------
+
+def iterparse(fileobj, chunk_size = _CHUNK_SIZE):
+    ''' Parse the Lua table read from the file-like object fileobj and yield
+    (event, value) pairs while reading it in chunks of chunk_size characters:
+        ('start_table', None)  a table constructor opens
+        ('key', key)           the next field has the explicit key key
+        ('value', value)       a field value that is not a table
+        ('end_table', None)    the innermost open table closes
+    Fields without a key get no 'key' event; they take the next array index
+    in their table as in Lua. Nil values are reported as ('value', None) and
+    repeated keys are reported as they appear, so dropping them is up to the
+    consumer. Text after the table is ignored, and a stream that holds no
+    table at all yields no events. Memory use is bounded by chunk_size and the
+    nesting depth, plus the size of the longest single token.
+    Throws LuaParseError when the table has grammar errors.
+    '''
+    return _iterEvents(chain.from_iterable(_iterTokenChunks(fileobj.read, chunk_size)))
+
+# Tables are sent to the workers of iterload() in batches of about this many
+# tokens.
+_BATCH_TOKENS = 64 * 1024
+
+def iterload(fileobj, chunk_size = _CHUNK_SIZE, workers = None):
+    ''' Parse the Lua tables that follow each other in the file-like object
+    fileobj, like a log of one table per line, and yield what dumpDict()
+    would return for each of them, in order, while reading fileobj in chunks
+    of chunk_size characters. Only whitespace and comments may come between
+    the tables. With more than one worker, tables are parsed by a pool of
+    that many processes while the next ones are being read; memory use then
+    grows with the number of workers instead of with the stream.
+    Throws LuaParseError when a table has grammar errors, after yielding the
+    tables before it.
+    '''
+    windows = _iterTokenChunks(fileobj.read, chunk_size)
+    if(workers is None or workers <= 1):
+        return _iterTables(windows)
+    return _iterTablesPooled(windows, workers)
+
+def _iterTables(windows):
+    # One parser goes through the windows; _nextTable() leaves its position
+    # just after the table it read, where the next one starts.
+    parser = PyLuaTblParser()
+    parser._windows = windows
+    tokens = windows.next()
+    index = 0
+    while True:
+        if(index == len(tokens)):
+            tokens = windows.next()
+            index = 0
+        if(len(tokens[index]) == 0):
+            return
+        parser._tokens = tokens
+        parser._pos = index
+        yield parser._nextTable()
+        (tokens, index) = (parser._tokens, parser._pos)
+
+def _iterTablesPooled(windows, workers):
+    # At most _BATCHES_PER_WORKER batches per worker are in flight, so that a
+    # stream that is read faster than it is parsed is not read ahead whole.
+    pool = Pool(workers)
+    pending = deque()
+    try:
+        for batch in _batchDocuments(windows):
+            pending.append(pool.apply_async(_loadDocuments, (batch,)))
+            if(len(pending) >= workers * _BATCHES_PER_WORKER):
+                for table in _loadedTables(pending.popleft().get()):
+                    yield table
+        pool.close()
+        while(len(pending) > 0):
+            for table in _loadedTables(pending.popleft().get()):
+                yield table
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _loadedTables(results):
+    for result in results:
+        if(isinstance(result, LuaParseError)):
+            raise result
+        yield result
+
+def _batchDocuments(windows):
+    # Cuts the tokens into the tables they hold by counting braces, each
+    # ended with '' like a whole text, and yields them in lists of about
+    # _BATCH_TOKENS tokens. Whatever is not a table is passed on for
+    # _nextTable() to report.
+    batch = []
+    size = 0
+    document = []
+    depth = 0
+    for window in windows:
+        start = 0
+        for index, token in enumerate(window):
+            if(token == '{'):
+                depth += 1
+                continue
+            elif(token == '}'):
+                depth -= 1
+                if(depth > 0):
+                    continue
+            elif(depth > 0):
+                continue
+            elif(len(token) == 0):
+                if(len(batch) > 0):
+                    yield batch
+                return
+            document.extend(window[start:index + 1])
+            document.append('')
+            batch.append(document)
+            size += len(document)
+            document = []
+            start = index + 1
+            if(depth < 0 or token != '}'):
+                yield batch
+                return
+            if(size >= _BATCH_TOKENS):
+                yield batch
+                batch = []
+                size = 0
+        document.extend(window[start:])
+    batch.append(document)
+    yield batch
+
+def _loadDocuments(documents):
+    # Runs in a worker: the tables of documents in order, followed by the
+    # LuaParseError of the first one that fails to parse, if any.
+    results = []
+    parser = PyLuaTblParser()
+    try:
+        for tokens in documents:
+            parser._tokens = tokens
+            parser._pos = 0
+            results.append(parser._nextTable())
+    except LuaParseError, e:
+        results.append(e)
+    return results
+
+def tokenize(s):
+    ''' Split the Lua text s, which may be anything load() accepts, into
+    tokens and yield a (type, value, offset) tuple for each of them, offset
+    being where the token starts in s:
+        ('symbol', text, offset)   one of { } [ ] = , ;
+        ('name', text, offset)     a name, including nil, true and false
+        ('number', value, offset)  a number, converted to int or float
+        ('string', value, offset)  a string or long string, unescaped
+    Whitespace and comments are skipped. Tokens are produced as they are
+    consumed, so no table and no list of tokens is built.
+    Throws LuaParseError when it reaches a malformed token.
+    '''
+    if(isinstance(s, memoryview)):
+        s = s.tobytes()
+    elif(not isinstance(s, (basestring, buffer, mmap))):
+        s = buffer(s)
+    if(_deep_bracket_pattern.search(s) is None):
+        (pattern, group) = (_token_pattern, 1)
+    else:
+        (pattern, group) = (_deep_token_pattern, 2)
+    for match in pattern.finditer(s):
+        token = match.group(group)
+        if(len(token) == 0):
+            return
+        kind = _char_kinds.get(token[0])
+        if(token in _symbols):
+            yield ('symbol', token, match.start(group))
+        elif(kind == _CHAR_NAME):
+            yield ('name', token, match.start(group))
+        elif(kind == _CHAR_NUMBER):
+            yield ('number', _parseNumber(token), match.start(group))
+        elif(kind == _CHAR_STRING or kind == _CHAR_BRACKET):
+            yield ('string', _parseValue(token), match.start(group))
+        else:
+            raise LuaParseError('Unrecognized token \'' + token + '\'')
+
+_symbols = frozenset('{}[]=,;')
+
+def _iterTokenChunks(read, chunkSize):
+    # Yields lists of tokens of the text returned by read(chunkSize) calls. The
+    # tail _lexWindow() leaves out is lexed again together with the next chunk.
+    carry = ''
+    readSize = chunkSize
+    while True:
+        chunk = read(readSize)
+        text = carry + chunk
+        if(len(chunk) == 0):
+            yield _tokenize(text)
+            return
+        newline = text.rfind('\n')
+        if(newline > 0):
+            (tokens, cut) = _lexWindow(text, 0, newline, True)
+        else:
+            (tokens, cut) = _lexWindow(text, 0, len(text))
+        carry = text[cut:]
+        if(len(tokens) == 0):
+            readSize = max(chunkSize, len(carry))
+            continue
+        readSize = chunkSize
+        yield tokens
+
+def _iterEvents(tokens):
+    nextToken = iter(tokens).next
+    token = nextToken()
+    if(len(token) == 0):
+        return
+    if(token != '{'):
+        raise LuaParseError(_unexpectedMessage('Expecting \'{\' when parsing table.', token))
+    yield ('start_table', None)
+    depth = 1
+    token = nextToken()
+    while True:
+        if(token == '}'):
+            yield ('end_table', None)
+            depth -= 1
+            if(depth == 0):
+                return
+            token = nextToken()
+        else:
+            hasValue = False
+            if(token == '['):
+                key = PyLuaTblParser._asIndex(nextToken())
+                token = nextToken()
+                if(token != ']'):
+                    raise LuaParseError(_unexpectedMessage('Expecting \']\' after index.', token))
+                token = nextToken()
+                if(token != '='):
+                    raise LuaParseError(_unexpectedMessage('Expecting \'=\' after table index.', token))
+                yield ('key', key)
+                token = nextToken()
+            elif(token != '{'):
+                if(len(token) == 0):
+                    raise LuaParseError(_unexpectedMessage('Expecting field or key.', token))
+                following = nextToken()
+                if(following == '='):
+                    yield ('key', PyLuaTblParser._asName(token))
+                    token = nextToken()
+                else:
+                    yield ('value', _parseValue(token))
+                    token = following
+                    hasValue = True
+            if(not hasValue):
+                if(token == '{'):
+                    yield ('start_table', None)
+                    depth += 1
+                    token = nextToken()
+                    continue
+                yield ('value', _parseValue(token))
+                token = nextToken()
+
+        if(token == ',' or token == ';'):
+            token = nextToken()
+        elif(token != '}'):
+            raise LuaParseError(_unexpectedMessage( \
+                'Expecting \',\' or \';\' when seeking for next field separator.', token))
+
 if __name__ == '__main__':
     a1 = PyLuaTblParser()
     a2 = PyLuaTblParser()
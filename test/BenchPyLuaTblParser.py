@@ -0,0 +1,371 @@
+import argparse, json, math, os, random, subprocess, sys, tempfile, time
+from collections import Mapping, Sequence
+sys.path.append('../PyLuaTblParser/')
+
+from PyLuaTblParser import PyLuaTblParser
+
+def nestedTable(depth, fields = 0):
+    # depth nested tables, each holding `fields` numbers before the inner table
+    prefix = ''.join(['%d, ' % i for i in xrange(fields)])
+    return ('{' + prefix) * depth + '}' * depth
+
+def timeLoad(s, repeat = 3):
+    p = PyLuaTblParser()
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        p.load(s)
+        elapsed = time.time() - start
+        if(best is None or elapsed < best):
+            best = elapsed
+    return best
+
+def timeDump(p, repeat = 3):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        p.dump()
+        elapsed = time.time() - start
+        if(best is None or elapsed < best):
+            best = elapsed
+    return best
+
+def stringTable(count, copies):
+    # count records, each with `copies` copies of a text that needs escaping
+    text = 'it\'s a "line"\twith\\escapes\n'
+    return {'records': [{'id': i, 'name': 'record %d' % i, 'text': text * copies} for i in xrange(count)]}
+
+def timeCall(f, repeat = 3):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        if(best is None or elapsed < best):
+            best = elapsed
+    return best
+
+def readAll(value):
+    # touch every node of a snapshot
+    if(isinstance(value, Mapping)):
+        return 1 + sum([readAll(item) for item in value.itervalues()])
+    elif(isinstance(value, Sequence) and not isinstance(value, basestring)):
+        return 1 + sum([readAll(item) for item in value])
+    return 1
+
+def benchNesting():
+    print 'depth      fields  load (s)    per level (us)'
+    for fields in [0, 4]:
+        for depth in [100, 400, 10000, 100000, 1000000]:
+            elapsed = timeLoad(nestedTable(depth, fields))
+            print '%-10d %-7d %-11.4f %.3f' % (depth, fields, elapsed, elapsed / depth * 1e6)
+
+def benchDump():
+    print 'records    copies  dump (s)    MB/s'
+    p = PyLuaTblParser()
+    for count, copies in [(100000, 1), (10000, 20), (100, 2000)]:
+        p.loadDict(stringTable(count, copies))
+        elapsed = timeDump(p)
+        print '%-10d %-7d %-11.4f %.1f' % (count, copies, elapsed, len(p.dump()) / elapsed / 1e6)
+
+def benchSnapshot():
+    print 'records    dumpDict (s)  snapshot (s)  read all (s)  first write (s)'
+    p = PyLuaTblParser()
+    for count in [1000, 100000, 300000]:
+        p.loadDict(stringTable(count, 1))
+        copy = timeCall(p.dumpDict)
+        snapshot = timeCall(p.snapshot)
+        read = timeCall(lambda: readAll(p.snapshot()))
+        def write():
+            p.snapshot()
+            p['records'][0]['id'] = 0
+        first = timeCall(write)
+        print '%-10d %-13.4f %-13.6f %-13.4f %.4f' % (count, copy, snapshot, read, first)
+
+#----------scaling suite-------------------
+# Each case is generated at sizes doubling from the base size, and each
+# operation is timed on it in a forked child, so that the peak memory of one
+# measurement does not carry over to the next. A slope of the time (or
+# memory) against the size above _SUPERLINEAR on a log-log scale is flagged.
+# Times under _MIN_SECONDS and peaks under _MIN_PEAK_KB are mostly noise and
+# left out of the slopes.
+_SIZES = 4
+_MIN_SECONDS = 0.005
+_MIN_PEAK_KB = 1024
+_SUPERLINEAR = 1.25
+_SLOWER = 1.2
+
+class TableGenerator:
+    ''' Generates Lua table text, the same for the same seed:
+        items          number of fields of the outermost table
+        depth          how deep subtables nest
+        listRatio      share of the tables that are lists rather than dicts
+        stringLength   length of the strings
+        escapeDensity  share of the characters of strings that need escaping
+        commentDensity share of the fields that are preceded by a comment
+    '''
+    def __init__(self, items, depth = 1, listRatio = 0.5, stringLength = 8, escapeDensity = 0.0, \
+        commentDensity = 0.0, seed = 0):
+        self.items = items
+        self.depth = depth
+        self.listRatio = listRatio
+        self.stringLength = stringLength
+        self.escapeDensity = escapeDensity
+        self.commentDensity = commentDensity
+        self.random = random.Random(seed)
+
+    def text(self):
+        chunks = []
+        self._table(chunks, self.items, self.depth, False)
+        return ''.join(chunks)
+
+    def _table(self, chunks, items, depth, isList):
+        # The outermost table is a dict; subtables share out its items.
+        chunks.append('{')
+        inner = max(1, items // 8)
+        for i in xrange(items):
+            if(self.random.random() < self.commentDensity):
+                chunks.append('-- field %d\n' % i)
+            if(not isList):
+                chunks.append('f%d=' % i)
+            if(depth > 1 and i % 8 == 0):
+                self._table(chunks, min(inner, 8), depth - 1, self.random.random() < self.listRatio)
+            elif(i % 3 == 0):
+                chunks.append(self._string())
+            elif(i % 3 == 1):
+                chunks.append(str(self.random.randint(-10 ** 6, 10 ** 6)))
+            else:
+                chunks.append(repr(self.random.random() * 1000))
+            chunks.append(',')
+        chunks.append('}')
+
+    def _string(self):
+        characters = []
+        for i in xrange(self.stringLength):
+            if(self.random.random() < self.escapeDensity):
+                characters.append(self.random.choice(['\\n', '\\t', '\\"', '\\\\', '\\065']))
+            else:
+                characters.append(chr(self.random.randint(97, 122)))
+        return '"' + ''.join(characters) + '"'
+
+def longString(size):
+    return '{"' + 'x' * (size * 100) + '"}'
+
+def deepNesting(size):
+    return '{' * size + '}' * size
+
+def commentRun(size):
+    return '{' + '-- just a comment line\n' * size + '1}'
+
+# name: (text for a size, base size)
+_CASES = [
+    ('flat', lambda n: TableGenerator(n, listRatio = 0.0).text(), 20000),
+    ('mixed', lambda n: TableGenerator(n, depth = 3, stringLength = 16, escapeDensity = 0.1, \
+        commentDensity = 0.1).text(), 20000),
+    ('lists', lambda n: TableGenerator(n, depth = 3, listRatio = 1.0).text(), 20000),
+    ('escaped strings', lambda n: TableGenerator(n // 4, stringLength = 200, \
+        escapeDensity = 0.5).text(), 20000),
+    ('comments', lambda n: TableGenerator(n, commentDensity = 1.0).text(), 20000),
+    ('long string', longString, 20000),
+    ('deep nesting', deepNesting, 20000),
+    ('comment run', commentRun, 20000),
+]
+
+def _setUp(operation, text, path):
+    # Returns what has to be timed for operation, with what it needs done.
+    p = PyLuaTblParser()
+    if(operation == 'load'):
+        return lambda: p.load(text)
+    elif(operation == 'loadLuaTable'):
+        return lambda: p.loadLuaTable(path)
+    p.load(text)
+    if(operation == 'dump'):
+        return p.dump
+    elif(operation == 'dumpLuaTable'):
+        return lambda: p.dumpLuaTable(path + '.out')
+    elif(operation == 'dumpDict'):
+        return p.dumpDict
+    d = p.dumpDict()
+    return lambda: p.loadDict(d)
+
+_OPERATIONS = ['load', 'dump', 'loadDict', 'dumpDict', 'loadLuaTable', 'dumpLuaTable']
+
+def _peakMemory():
+    # Peak resident size in kB since the last reset, or None off Linux.
+    try:
+        for line in open('/proc/self/status'):
+            if(line.startswith('VmHWM:')):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+def _resetPeakMemory():
+    try:
+        outfile = open('/proc/self/clear_refs', 'w')
+        outfile.write('5')
+        outfile.close()
+    except IOError:
+        pass
+
+def measure(operation, text, path, repeat = 5):
+    ''' Time operation on text in a forked child and return (seconds, peak
+    memory in kB above what the child started the operation with, error),
+    error being the message of the exception the operation threw, if any.
+    '''
+    (readEnd, writeEnd) = os.pipe()
+    pid = os.fork()
+    if(pid == 0):
+        os.close(readEnd)
+        try:
+            try:
+                f = _setUp(operation, text, path)
+                _resetPeakMemory()
+                start = _peakMemory()
+                elapsed = timeCall(f, repeat)
+                peak = _peakMemory()
+                reply = [elapsed, None if peak is None else peak - start, None]
+            except Exception, e:
+                reply = [None, None, '%s: %s' % (type(e).__name__, e)]
+            os.write(writeEnd, json.dumps(reply))
+        finally:
+            os._exit(0)
+    os.close(writeEnd)
+    reply = ''
+    while True:
+        data = os.read(readEnd, 4096)
+        if(len(data) == 0):
+            break
+        reply += data
+    os.close(readEnd)
+    os.waitpid(pid, 0)
+    return tuple(json.loads(reply))
+
+def slope(xs, ys, least):
+    # Least squares slope of log(y) against log(x) over the points where y is
+    # at least least, None without enough of them.
+    points = [(math.log(x), math.log(y)) for x, y in zip(xs, ys) if y is not None and y >= least]
+    if(len(points) < 2):
+        return None
+    meanX = sum([x for x, y in points]) / len(points)
+    meanY = sum([y for x, y in points]) / len(points)
+    variance = sum([(x - meanX) ** 2 for x, y in points])
+    if(variance == 0):
+        return None
+    return sum([(x - meanX) * (y - meanY) for x, y in points]) / variance
+
+def runSuite(scale = 1.0, cases = None, operations = _OPERATIONS):
+    ''' Run the scaling suite and return its results as a dict that can be
+    saved as JSON.
+    '''
+    results = []
+    slopes = {}
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.lua')
+    try:
+        for name, generate, base in _CASES:
+            if(cases is not None and name not in cases):
+                continue
+            texts = []
+            for i in xrange(_SIZES):
+                size = int(base * scale) << i
+                texts.append((size, generate(size)))
+            for operation in operations:
+                rows = []
+                for size, text in texts:
+                    outfile = open(path, 'w')
+                    outfile.write(text)
+                    outfile.close()
+                    (seconds, peak, error) = measure(operation, text, path)
+                    rows.append({'case': name, 'operation': operation, 'size': size, \
+                        'bytes': len(text), 'seconds': seconds, 'peak_kb': peak, 'error': error, \
+                        'mb_per_s': len(text) / seconds / 1e6 if seconds else None})
+                results.extend(rows)
+                key = '%s/%s' % (name, operation)
+                slopes[key] = {'time': slope([row['bytes'] for row in rows], \
+                                   [row['seconds'] for row in rows], _MIN_SECONDS),
+                               'memory': slope([row['bytes'] for row in rows], \
+                                   [row['peak_kb'] for row in rows], _MIN_PEAK_KB)}
+                printRows(rows, slopes[key])
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    return {'commit': gitCommit(), 'python': sys.version.split()[0], 'scale': scale, \
+        'results': results, 'slopes': slopes}
+
+def printRows(rows, slopes):
+    for row in rows:
+        if(row['error'] is not None):
+            print '%-16s %-13s %-9d %-11d %s' % (row['case'], row['operation'], row['size'], \
+                row['bytes'], row['error'])
+            continue
+        print '%-16s %-13s %-9d %-11d %-10.4f %-9s %s' % (row['case'], row['operation'], \
+            row['size'], row['bytes'], row['seconds'], \
+            '%.1f' % row['mb_per_s'] if row['mb_per_s'] else '-', \
+            row['peak_kb'] if row['peak_kb'] is not None else '-')
+    flags = []
+    for kind in ['time', 'memory']:
+        if(slopes[kind] is not None):
+            flag = ' SUPER-LINEAR' if slopes[kind] > _SUPERLINEAR else ''
+            flags.append('%s slope %.2f%s' % (kind, slopes[kind], flag))
+    print '    %s/%s: %s' % (rows[0]['case'], rows[0]['operation'], ', '.join(flags) or 'too fast to tell')
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], \
+            stderr = open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old, new):
+    ''' Print how much slower or faster each measurement of new is than the
+    same one of old, flagging those more than _SLOWER times slower, and
+    return how many were flagged.
+    '''
+    before = dict([((row['case'], row['operation'], row['size']), row) for row in old['results']])
+    flagged = 0
+    print 'comparing %s with %s' % (new.get('commit'), old.get('commit'))
+    for row in new['results']:
+        previous = before.get((row['case'], row['operation'], row['size']))
+        if(previous is None or not previous['seconds'] or not row['seconds']):
+            continue
+        ratio = row['seconds'] / previous['seconds']
+        flag = ''
+        if(ratio > _SLOWER):
+            flag = ' SLOWER'
+            flagged += 1
+        print '%-16s %-13s %-9d %.2fx%s' % (row['case'], row['operation'], row['size'], ratio, flag)
+    return flagged
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmarks of PyLuaTblParser.')
+    parser.add_argument('--suite', action = 'store_true', \
+        help = 'run the scaling suite instead of the micro benchmarks')
+    parser.add_argument('--scale', type = float, default = 1.0, help = 'multiplies the sizes')
+    parser.add_argument('--case', action = 'append', help = 'run only this case')
+    parser.add_argument('--operation', action = 'append', help = 'run only this operation')
+    parser.add_argument('--json', help = 'save the results of the suite to this file')
+    parser.add_argument('--compare', help = 'compare with results saved by --json')
+    options = parser.parse_args()
+    if(not options.suite):
+        benchNesting()
+        benchDump()
+        benchSnapshot()
+        return 0
+    print 'case             operation     size      bytes       time (s)   MB/s      peak (kB)'
+    results = runSuite(options.scale, options.case, options.operation or _OPERATIONS)
+    if(options.json):
+        outfile = open(options.json, 'w')
+        json.dump(results, outfile, indent = 1, sort_keys = True)
+        outfile.close()
+    if(options.compare):
+        infile = open(options.compare)
+        old = json.load(infile)
+        infile.close()
+        if(compare(old, results) > 0):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,12 @@
-import sys, traceback
+import marshal, os, random, shutil, sys, tempfile, traceback
+from array import array
+from collections import MutableMapping, MutableSequence
+from copy import deepcopy
+from cStringIO import StringIO
 sys.path.append('../PyLuaTblParser/')
 
-from PyLuaTblParser import PyLuaTblParser, LuaParseError
+from PyLuaTblParser import PyLuaTblParser, LuaParseError, iterparse, tokenize, load_many, \
+    ParseCache, iterload, StringPool, LuaTable
 
 def testfile(f):
     p1 = PyLuaTblParser()
@@ -53,6 +58,914 @@ def testSingleTableFile(f):
     infile.close()
 
 
+def buildFromEvents(events):
+    # Rebuild what load() returns from iterparse() events.
+    stack = []
+    for event, value in events:
+        if(event == 'start_table'):
+            stack.append({'fields': {}, 'arrayIndex': 1, 'hasKey': False, 'key': None})
+            continue
+        if(event == 'key'):
+            stack[-1]['key'] = value
+            continue
+        if(event == 'end_table'):
+            table = stack.pop()
+            fields = table['fields']
+            if(table['hasKey']):
+                value = dict((k, v) for k, v in fields.iteritems() if v is not None)
+            else:
+                value = [fields[k] for k in sorted(fields)]
+            if(len(stack) == 0):
+                return value
+        table = stack[-1]
+        key = table['key']
+        if(key is None):
+            table['fields'][table['arrayIndex']] = value
+            table['arrayIndex'] += 1
+        else:
+            table['key'] = None
+            table['hasKey'] = True
+            if(value is not None and not (isinstance(key, int) and key < table['arrayIndex'])):
+                table['fields'][key] = value
+
+def testIterparse(f):
+    p = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p.load(line)
+            d1 = p.dumpDict()
+        except LuaParseError:
+            d1 = None
+        for chunkSize in [1, 2, 3, 7, 4096]:
+            try:
+                d2 = buildFromEvents(iterparse(StringIO(line), chunkSize))
+            except LuaParseError:
+                d2 = None
+            if(d1 != d2):
+                print 'input : ' + line
+                print 'chunk size: ', chunkSize
+                print 'd1: ', d1
+                print 'd2: ', d2
+                raise Exception('Iterparse Error!')
+    infile.close()
+
+def testLazy(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+        except LuaParseError:
+            continue
+        d1 = p1.dumpDict()
+        p2.load(line, lazy = True)
+        if(p2.dump() != p1.dump() or p2.dumpDict() != d1):
+            print 'input : ' + line
+            raise Exception('Lazy Dump Error!')
+        keys = d1.keys() if isinstance(d1, dict) else xrange(len(d1))
+        for key in keys:
+            if(p2[key] != d1[key]):
+                print 'input : ' + line
+                print 'key: ', key
+                raise Exception('Lazy Load Error!')
+        if(p2.dumpDict() != d1):
+            print 'input : ' + line
+            raise Exception('Lazy Load Error!')
+    infile.close()
+    # Subtables are parsed from the file as it was loaded, even once it has
+    # been rewritten or truncated.
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'lazy.lua')
+        outfile = open(path, 'w')
+        outfile.write('{a = {1, 2, "three"}, b = {x = 1}}')
+        outfile.close()
+        p2.loadLuaTable(path, lazy = True)
+        outfile = open(path, 'w')
+        outfile.write('{}')
+        outfile.close()
+        if(p2['a'] != [1, 2, 'three'] or p2['b'] != {'x': 1}):
+            raise Exception('Lazy Load Error! File changed under the table.')
+    finally:
+        shutil.rmtree(directory)
+    # Blank text leaves the table as it was, and no state of the load behind.
+    p2.load(' \n ', lazy = True)
+    if(p2._tables is not None or p2['a'] != [1, 2, 'three']):
+        raise Exception('Lazy Load Error! Blank text.')
+
+def testBufferInput(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+            d1 = p1.dumpDict()
+        except LuaParseError:
+            d1 = None
+        for s in [bytearray(line), memoryview(line), buffer(line)]:
+            try:
+                p2.load(s)
+                d2 = p2.dumpDict()
+            except LuaParseError:
+                d2 = None
+            if(d1 != d2):
+                print 'input : ' + line
+                print 'type: ', type(s)
+                raise Exception('Buffer Load Error!')
+    infile.close()
+
+def testDumpStrings():
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    allChars = ''.join([chr(i) for i in xrange(256)])
+    strings = [allChars, allChars + '1', '\0' + '12', 'x]]' * 30, ']=]' * 30 + ']', \
+        '\n' * 100, 'long\tstring\n' * 10, u'unicode']
+    p1.loadDict({'list': strings, 'dict': dict([(s, s) for s in strings]), 'float': 0.1 + 0.2})
+    p2.load(p1.dump())
+    if(p1.dumpDict() != p2.dumpDict()):
+        print p1.dump()
+        raise Exception('Dump Strings Error!')
+
+def testDeepNesting():
+    # Tables nested deeper than the recursion limit can be dumped and copied.
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    depth = 5000
+    text = '{a = ' * depth + '{1, {x = 2}}' + '}' * depth
+    p1.load(text)
+    dumped = p1.dump()
+    out = StringIO()
+    p1.dumpLuaTable(out)
+    p2.loadDict(p1.dumpDict())
+    if(out.getvalue() != dumped or p2.dump() != dumped or dumped.count('{') != depth + 2):
+        raise Exception('Deep Nesting Error!')
+    p2.load(dumped)
+    if(p2.dump() != dumped):
+        raise Exception('Deep Nesting Error! Dump does not load back.')
+
+def testDumpStream(f):
+    p = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p.load(line)
+        except LuaParseError:
+            continue
+        for bufferSize in [0, 1, 16, 4096]:
+            output = StringIO()
+            written = p.dumpLuaTable(output, bufferSize)
+            if(output.getvalue() != p.dump() or written != len(output.getvalue())):
+                print 'input : ' + line
+                print 'buffer size: ', bufferSize
+                raise Exception('Dump Stream Error!')
+    infile.close()
+
+def testSnapshot(f):
+    p = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        for lazy in [False, True]:
+            try:
+                p.load(line, lazy = lazy)
+            except LuaParseError:
+                continue
+            d = p.dumpDict()
+            snapshot = p.snapshot()
+            keys = d.keys() if isinstance(d, dict) else range(len(d))
+            for key in keys:
+                value = p[key]
+                if(isinstance(value, MutableMapping)):
+                    value['changed'] = True
+                    for item in value.values():
+                        if(isinstance(item, MutableSequence)):
+                            item.append('changed')
+                elif(isinstance(value, MutableSequence)):
+                    value.append('changed')
+                if(value != p[key]):
+                    print 'input : ' + line
+                    raise Exception('Snapshot Error! Change lost.')
+                p[key] = 'changed'
+            if(snapshot != d or p.snapshot() != p.dumpDict()):
+                print 'input : ' + line
+                print 'lazy: ', lazy
+                raise Exception('Snapshot Error!')
+    infile.close()
+    # Two stand-ins for one field see each other's changes, and only the
+    # tables on the way to a change are copied.
+    p.load('{{1}, {2, {3}}, {4}}')
+    snapshot = p.snapshot()
+    (a, b) = (p[-1], p[-1])
+    a.append(99)
+    b.append(100)
+    p[1][1].append(5)
+    if(p.dumpDict() != [[1], [2, [3, 5]], [4, 99, 100]] or snapshot != [[1], [2, [3]], [4]] or \
+        p._dict[0] is not snapshot._table[0]):
+        raise Exception('Snapshot Error! ' + repr(p.dumpDict()))
+    # A stand-in whose field was replaced, or whose table was loaded again,
+    # changes neither the table nor the snapshot.
+    p.load('{a={b={c=1}}}')
+    snapshot = p.snapshot()
+    b = p['a']['b']
+    p['a'] = {'b': {'c': 5, 'd': 6}}
+    b['c'] = 2
+    if(p.dumpDict() != {'a': {'b': {'c': 5, 'd': 6}}} or snapshot != {'a': {'b': {'c': 1}}} or \
+        b != {'c': 2}):
+        raise Exception('Snapshot Error! ' + repr(p.dumpDict()))
+    a = p['a']
+    p.load('{b=1}')
+    a['k'] = 1
+    if(p.dumpDict() != {'b': 1} or snapshot != {'a': {'b': {'c': 1}}} or a['k'] != 1):
+        raise Exception('Snapshot Error! ' + repr(snapshot))
+
+def testTokenize(f):
+    p = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p.load(line)
+        except LuaParseError:
+            continue
+        for kind, value, offset in tokenize(line):
+            if(kind == 'symbol' or kind == 'name'):
+                ok = line.startswith(value, offset)
+            elif(kind == 'string'):
+                ok = line[offset] in '"\'['
+            else:
+                ok = line[offset] in '0123456789.+-'
+            if(not ok):
+                print 'input : ' + line
+                print 'token: ', (kind, value, offset)
+                raise Exception('Tokenize Error!')
+    infile.close()
+
+def testLoadMany(f):
+    p = PyLuaTblParser()
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        expected = []
+        infile = open(f)
+        for line in infile:
+            line = line.strip()
+            if(len(line) == 0 or line[0] == '#'):
+                continue
+            path = os.path.join(directory, '%d.lua' % len(paths))
+            outfile = open(path, 'w')
+            outfile.write(line)
+            outfile.close()
+            paths.append(path)
+            try:
+                p.load(line)
+                expected.append(p.dumpDict())
+            except LuaParseError:
+                expected.append(None)
+        infile.close()
+        for workers in [1, 3]:
+            (tables, errors) = load_many(paths, workers)
+            failed = [i for i in xrange(len(paths)) if expected[i] is None]
+            if(tables != expected or sorted(errors) != failed):
+                print 'workers: ', workers
+                raise Exception('Load Many Error!')
+        try:
+            load_many(paths + [os.path.join(directory, 'missing.lua')], 1)
+        except OSError:
+            pass
+        else:
+            raise Exception('Load Many Error! No error for a missing file.')
+    finally:
+        shutil.rmtree(directory)
+
+def testParseCache(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(1024, directory)
+        path = os.path.join(directory, 'table.lua')
+        infile = open(f)
+        for line in infile:
+            line = line.strip()
+            if(len(line) == 0 or line[0] == '#'):
+                continue
+            try:
+                p1.load(line)
+            except LuaParseError:
+                continue
+            outfile = open(path, 'w')
+            outfile.write(line)
+            outfile.close()
+            # A new size or mtime invalidates the entry of the previous line.
+            os.utime(path, (0, cache.misses))
+            for p2Cache in [cache, cache, ParseCache(1024, directory)]:
+                p2.load(line, cache = p2Cache)
+                if(p2.dumpDict() != p1.dumpDict()):
+                    print 'input : ' + line
+                    raise Exception('Parse Cache Error!')
+                p2.loadLuaTable(path, cache = p2Cache)
+                if(p2.dumpDict() != p1.dumpDict()):
+                    print 'input : ' + line
+                    raise Exception('Parse Cache Error!')
+        infile.close()
+        if(cache.hits == 0):
+            raise Exception('Parse Cache Error!')
+        # A unicode text loads unicode strings, even after the equal str text.
+        for text in ['{a="x"}', u'{a="x"}', u'{a="\u00e9"}', u'{a="\u00e9"}']:
+            p2.load(text, cache = cache)
+            if(p2['a'] != text[4:-2] or type(p2['a']) is not type(text)):
+                print 'input : ' + repr(text)
+                raise Exception('Parse Cache Error! Unicode')
+    finally:
+        shutil.rmtree(directory)
+
+def testBinary(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+        except LuaParseError:
+            continue
+        p1.dumpBinary('test_dump.bin')
+        data = p1.dumpBinary()
+        for source in ['test_dump.bin', data, bytearray(data), StringIO(data)]:
+            p2.loadBinary(source)
+            if(p2.dumpDict() != p1.dumpDict()):
+                print 'input : ' + line
+                print 'type: ', type(source)
+                raise Exception('Binary Dump Error!')
+        p2.loadBinary(data, trusted = True)
+        if(p2.dumpDict() != p1.dumpDict()):
+            print 'input : ' + line
+            raise Exception('Binary Dump Error! Trusted load differs.')
+    infile.close()
+    os.remove('test_dump.bin')
+    # Only what dumpBinary() writes loads, even where marshal reads more.
+    p1.load('{}')
+    header = p1.dumpBinary()[:-len(marshal.dumps(p1.dumpDict(), 2))]
+    for table in [(1, 2), [1, (2,)], {'a': frozenset([1])}, [{(1,): 2}], {'a': [1j]}, \
+        [{'a': [testBinary.func_code]}], {True: 1}]:
+        try:
+            p2.loadBinary(header + marshal.dumps(table, 2))
+        except LuaParseError:
+            continue
+        print 'table : ', table
+        raise Exception('Binary Load Error! No error for broken table')
+
+def testEdit(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    rand = random.Random(0)
+    pieces = ['{', '}', '1', ',', 'a = 2', '"x"', '\'', '[[', ']]', '--', '\n', '{b = {3}}', '[1] =', 'nil']
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line, editable = True)
+        except LuaParseError:
+            continue
+        for i in xrange(20):
+            offset = rand.randint(0, len(line))
+            deleted = rand.randint(0, min(3, len(line) - offset))
+            inserted = rand.choice(pieces)
+            edited = line[:offset] + inserted + line[offset + deleted:]
+            try:
+                p2.load(edited)
+                expected = p2.dumpDict()
+                line = edited
+            except LuaParseError:
+                expected = p1.dumpDict()
+            try:
+                p1.edit(offset, deleted, inserted)
+            except LuaParseError:
+                pass
+            if(p1.dumpDict() != expected):
+                print 'input : ' + line
+                print 'edit: ', (offset, deleted, inserted)
+                raise Exception('Edit Error!')
+    infile.close()
+    # Texts given as buffers are edited as str.
+    text = '{a = {1, 2}, b = "x"}'
+    for (source, cache) in [(memoryview(text), None), (bytearray(text), None), \
+        (bytearray(text), ParseCache()), (buffer(text), ParseCache())]:
+        p1.load(source, cache = cache, editable = True)
+        p1.edit(text.index('2'), 1, '{3}')
+        if(p1.dumpDict() != {'a': [1, [3]], 'b': 'x'}):
+            print 'type: ', type(source)
+            raise Exception('Edit Error! ' + repr(p1.dumpDict()))
+
+def testDiff(f):
+    tables = []
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+            tables.append(p1.dumpDict())
+        except LuaParseError:
+            continue
+    infile.close()
+    for old, new in zip(tables, tables[1:] + tables[:1]):
+        p1.loadDict(new)
+        p2.loadDict(old)
+        delta = p1.diff(p2)
+        p2.applyPatch(delta)
+        if(p2.dumpDict() != new):
+            print 'old: ', old
+            print 'new: ', new
+            print 'delta: ', delta
+            raise Exception('Diff Error!')
+        # Same through the Lua form of the delta and a snapshot.
+        p2.loadDict(old)
+        snapshot = p2.snapshot()
+        p2.loadDict(delta)
+        p2.load(p2.dump())
+        delta = p2.dumpDict()
+        p2.loadDict(snapshot)
+        p2.applyPatch(delta)
+        p1.load(p1.dump())
+        p2.load(p2.dump())
+        if(p2.dumpDict() != p1.dumpDict()):
+            print 'old: ', old
+            print 'new: ', new
+            print 'delta: ', delta
+            raise Exception('Diff Error!')
+
+unselected = object()
+
+def project(value, path):
+    # What load(s, select = [path]) keeps of a loaded value.
+    if(len(path) == 0):
+        return value
+    if(isinstance(value, dict)):
+        keys = [key for key in value if path[0] == '*' or key == path[0]]
+        result = {}
+        for key in keys:
+            item = project(value[key], path[1:])
+            if(item is not unselected):
+                result[key] = item
+        return result
+    if(isinstance(value, list)):
+        indexes = [i for i in xrange(len(value)) if path[0] == '*' or i == path[0]]
+        items = [project(value[i], path[1:]) for i in indexes]
+        return [item for item in items if item is not unselected]
+    return unselected
+
+def testSelect(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    infile = open(f)
+    lines = [line.strip() for line in infile]
+    infile.close()
+    # Later fields replace earlier ones with the same key, selected or not.
+    lines += ['{k1 = {true, -2.5}, k1 = 1e10}', '{[1] = {}, 1}', '{a = 1, a = {b = 2}}', \
+        '{a = {b = 2}, a = nil}', '{{x = 1}, [1] = 2, [2] = {x = 3}}']
+    for line in lines:
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+        except LuaParseError:
+            continue
+        d = p1.dumpDict()
+        keys = d.keys() if isinstance(d, dict) else range(len(d))
+        paths = [['*'], ['*', '*'], ['*', 1], ['*', 'real']] + [[key, '*'] for key in keys]
+        for path in paths:
+            p2.load(line, select = [path])
+            if(p2.dumpDict() != project(d, path)):
+                print 'input : ' + line
+                print 'path: ', path
+                print p2.dumpDict()
+                raise Exception('Select Error!')
+
+def testIterload(f):
+    p = PyLuaTblParser()
+    lines = []
+    expected = []
+    bad = None
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p.load(line)
+            lines.append(line)
+            expected.append(p.dumpDict())
+        except LuaParseError:
+            if(bad is None and not p._isBlank(line)):
+                bad = line
+    infile.close()
+    text = '\n'.join(lines)
+    for chunkSize in [1, 7, 4096]:
+        for workers in [None, 2]:
+            tables = list(iterload(StringIO(text), chunkSize, workers))
+            if(tables != expected):
+                print 'chunk size: ', chunkSize, 'workers: ', workers
+                raise Exception('Iterload Error!')
+            tables = []
+            try:
+                for table in iterload(StringIO(text + '\n' + bad + '\n' + text), chunkSize, workers):
+                    tables.append(table)
+                raise Exception('Iterload Error! No error for ' + bad)
+            except LuaParseError:
+                if(tables != expected):
+                    print 'chunk size: ', chunkSize, 'workers: ', workers
+                    raise Exception('Iterload Error!')
+
+def testFeed(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    random.seed(17)
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+            expected = p1.dumpDict()
+        except LuaParseError:
+            expected = None
+        for size in [1, 2, 3, random.randint(4, 20)]:
+            try:
+                for start in xrange(0, len(line), size):
+                    p2.feed(line[start:start + size])
+                p2.close()
+                if(expected is None):
+                    raise Exception('Feed Error! No error for ' + line)
+            except LuaParseError:
+                if(expected is not None):
+                    print 'input : ' + line
+                    raise
+                continue
+            if(p2.dumpDict() != expected):
+                print 'input : ' + line
+                print 'size: ', size
+                print p2.dumpDict()
+                raise Exception('Feed Error!')
+    infile.close()
+    # A long string fed in small pieces is not lexed again for every piece.
+    text = '{a = "' + 'x' * 300000 + '", b = [[' + 'y\n' * 100000 + ']], c = {1, 2}}'
+    for start in xrange(0, len(text), 1400):
+        p2.feed(text[start:start + 1400])
+    p2.close()
+    p1.load(text)
+    if(p2.dumpDict() != p1.dumpDict()):
+        raise Exception('Feed Error!')
+
+def testInstrument(f):
+    p = PyLuaTblParser()
+    seen = []
+    p.instrument(callback = seen.append)
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#' or p._isBlank(line)):
+            continue
+        try:
+            p.load(line)
+        except LuaParseError:
+            continue
+        stats = p.stats
+        tokens = list(tokenize(line))
+        if(seen[-1] is not stats or stats.operation != 'load' or stats.bytes != len(line) or \
+            sum(stats.tokens.values()) != len(tokens) or \
+            stats.tables != len([token for token in tokens if token[:2] == ('symbol', '{')])):
+            print 'input : ' + line
+            print stats, stats.tokens, stats.tables
+            raise Exception('Instrument Error!')
+        p.dump()
+        if(p.stats.operation != 'dump' or p.stats.bytes != len(p.dump())):
+            raise Exception('Instrument Error!')
+    infile.close()
+    p.instrument(False)
+    p.load('{}')
+    if(p.stats is not None or len(seen) == 0):
+        raise Exception('Instrument Error!')
+
+def plainLists(value):
+    if(isinstance(value, array)):
+        return value.tolist()
+    elif(isinstance(value, dict)):
+        return dict([(key, plainLists(item)) for key, item in value.iteritems()])
+    elif(isinstance(value, list)):
+        return [plainLists(item) for item in value]
+    return value
+
+def testArrays(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    infile = open(f)
+    lines = [line.strip() for line in infile if len(line.strip()) > 0 and line.strip()[0] != '#']
+    infile.close()
+    numbers = ','.join([str(i) for i in xrange(50000)])
+    lines.append('{ints={%s}, floats={%s}, mixed={1, 2.5}, big={1, 99999999999999999999}}' % \
+        (numbers, numbers.replace(',', '.5;') + '.5'))
+    for line in lines:
+        try:
+            p1.load(line)
+        except LuaParseError:
+            try:
+                p2.load(line, arrays = True)
+                raise Exception('Arrays Error! No error for ' + line)
+            except LuaParseError:
+                continue
+        p2.load(line, arrays = True)
+        if(plainLists(p2.dumpDict()) != p1.dumpDict() or p2.dump() != p1.dump()):
+            print 'input : ' + line
+            raise Exception('Arrays Error!')
+    d = p2.dumpDict()
+    if(d['ints'].typecode != 'l' or d['floats'].typecode != 'd' or \
+        not isinstance(d['mixed'], list) or not isinstance(d['big'], list)):
+        raise Exception('Arrays Error!')
+
+def testInternStrings(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    pool = StringPool()
+    small = StringPool(max_strings = 4)
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+        except LuaParseError:
+            continue
+        for strings in [True, pool, small]:
+            p2.load(line, intern_strings = strings)
+            d = p2.dumpDict()
+            if(d != p1.dumpDict()):
+                print 'input : ' + line
+                raise Exception('Intern Error!')
+            table = p2._dict
+            if(isinstance(table, dict) and strings is pool):
+                for key in table:
+                    if(isinstance(key, str) and len(key) <= 32 and key is not intern(key)):
+                        print 'input : ' + line
+                        raise Exception('Intern Error! Key not interned: ' + key)
+    infile.close()
+    p2.load('{{name="a"}, {name="a"}, {name="a"}}', intern_strings = pool)
+    if(len(small) > 4 or len(pool) == 0 or pool.saved_bytes <= 0):
+        raise Exception('Intern Error!')
+    for strings in [True, pool]:
+        p2.load(u'{a="x", b={a="\u00e9"}, "x"}', intern_strings = strings)
+        if(p2.dumpDict() != {'a': u'x', 'b': {'a': u'\u00e9'}, 1: u'x'} or \
+            type(p2['b']['a']) is not unicode):
+            raise Exception('Intern Error! Unicode')
+
+def luaFields(value):
+    # The fields of a table as Lua sees them, whatever it was loaded as.
+    if(isinstance(value, list)):
+        value = dict([(index, item) for index, item in enumerate(value, 1) if item is not None])
+    if(isinstance(value, dict) or isinstance(value, LuaTable)):
+        return dict([(key, luaFields(item)) for key, item in value.iteritems()])
+    return value
+
+def testLuaTables(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+        except LuaParseError:
+            continue
+        p2.load(line, lua_tables = True)
+        if(luaFields(p2._dict) != luaFields(p1._dict)):
+            print 'input : ' + line
+            raise Exception('LuaTable Error!')
+        p1.load(p2.dump(), lua_tables = True)
+        if(p1._dict != p2._dict):
+            print 'input : ' + line
+            raise Exception('LuaTable Error! Dump differs.')
+    infile.close()
+    t = LuaTable()
+    t[3] = 'c'
+    t[1] = 'a'
+    t.append('b')
+    if(t.border() != 3 or t.values() != ['a', 'b', 'c'] or t != {1: 'a', 2: 'b', 3: 'c'}):
+        raise Exception('LuaTable Error! ' + repr(t))
+    del t[2]
+    t['x'] = None
+    if(t.border() != 1 or t != {1: 'a', 3: 'c'}):
+        raise Exception('LuaTable Error! ' + repr(t))
+    t = LuaTable([1, None, 3], {'x': None})
+    if(2 in t or len(t) != 2 or t.border() != 1 or t != {1: 1, 3: 3}):
+        raise Exception('LuaTable Error! ' + repr(t))
+    try:
+        hash(t)
+    except TypeError:
+        pass
+    else:
+        raise Exception('LuaTable Error! LuaTable is hashable.')
+    # The MutableMapping methods it is registered for.
+    t = LuaTable(['a', 'b', 'c'], {'x': 1})
+    t.update({4: 'd'}, y = 2)
+    if(t.border() != 4 or t.setdefault('x', 3) != 1 or t.setdefault('z', 3) != 3):
+        raise Exception('LuaTable Error! ' + repr(t))
+    if(t.pop(2) != 'b' or t.pop(2, None) is not None or t.border() != 1 or t[4] != 'd'):
+        raise Exception('LuaTable Error! ' + repr(t))
+    if(t.popitem() != (1, 'a') or len(t) != 5):
+        raise Exception('LuaTable Error! ' + repr(t))
+    while(len(t) > 0):
+        t.popitem()
+    t.update([(1, 'a')])
+    t.clear()
+    if(len(t) != 0 or t != {}):
+        raise Exception('LuaTable Error! ' + repr(t))
+    try:
+        t.popitem()
+    except KeyError:
+        pass
+    else:
+        raise Exception('LuaTable Error! popitem() on an empty table.')
+
+def mergedFields(table, fields):
+    # What merge() should make of table and fields, by copying both.
+    result = dict(table)
+    for key, value in fields.iteritems():
+        if(value is None):
+            result.pop(key, None)
+        elif(isinstance(value, dict) and isinstance(result.get(key), dict)):
+            result[key] = mergedFields(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+def testMerge(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    tables = []
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+        except LuaParseError:
+            continue
+        if(isinstance(p1.dumpDict(), dict)):
+            tables.append(p1.dumpDict())
+    infile.close()
+    for table in tables:
+        for fields in tables[:10]:
+            for adopt in [False, True]:
+                p2.loadDict(table)
+                snapshot = p2.snapshot()
+                p2.merge(deepcopy(fields) if adopt else fields, adopt = adopt)
+                if(p2.dumpDict() != mergedFields(table, fields) or snapshot != table):
+                    print 'table : ' + repr(table)
+                    print 'fields : ' + repr(fields)
+                    raise Exception('Merge Error!')
+    p2.load('{a={b={c=1,d=2},e=3},f={1,2}}')
+    p2.merge({'a': {'b': {'c': 9, 'd': None}, 'e': None}, 'f': {1: 7}})
+    if(p2.dumpDict() != {'a': {'b': {'c': 9}}, 'f': {1: 7}}):
+        raise Exception('Merge Error! ' + repr(p2.dumpDict()))
+    p2.merge({'a': {'x': 1}}, deep = False)
+    if(p2.dumpDict()['a'] != {'x': 1}):
+        raise Exception('Merge Error! ' + repr(p2.dumpDict()))
+
+def testDedup(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+        except LuaParseError:
+            continue
+        for arrays in [False, True]:
+            p2.load(line, arrays = arrays, dedup = True)
+            if(plainLists(p2.dumpDict()) != p1.dumpDict() or p2.dump() != p1.dump()):
+                print 'input : ' + line
+                raise Exception('Dedup Error!')
+        p2.loadDict(p1.dumpDict(), dedup = True)
+        if(p2.dumpDict() != p1.dumpDict()):
+            print 'input : ' + line
+            raise Exception('Dedup Error!')
+    infile.close()
+    for load in [lambda s: p2.load(s, dedup = True), lambda s: p2.loadDict(p1.dumpDict(), dedup = True)]:
+        p1.load('{a = {v = {1, 2}, w = {1, 2}, x = {1.0, 2}, y = {true, 2}}, b = {v = {1, 2}, w = {1, 2}, ' + \
+            'x = {1.0, 2}, y = {true, 2}}}')
+        load(p1.dump())
+        d = p2._dict
+        if(d['a'] is not d['b'] or d['a']['v'] is not d['a']['w'] or d['a']['v'] is d['a']['x'] or \
+            d['a']['v'] is d['a']['y']):
+            raise Exception('Dedup Error! Tables not shared.')
+        snapshot = p2.snapshot()
+        p2['a']['v'].append(3)
+        copy = p2.dumpDict()
+        copy['b']['w'].append(4)
+        if(p2['a']['w'] != [1, 2] or p2['b']['v'] != [1, 2] or snapshot['a']['v'] != [1, 2] or \
+            p2.dumpDict()['b']['w'] != [1, 2]):
+            raise Exception('Dedup Error! Shared table changed.')
+    p2.load('{a = {0.0}, b = {-0.0}, c = {x = 0.0}, d = {x = -0.0}}', dedup = True)
+    if(p2._dict['a'] is p2._dict['b'] or p2._dict['c'] is p2._dict['d'] or \
+        p2.dump().count('-0.0') != 2):
+        raise Exception('Dedup Error! 0.0 and -0.0 shared.')
+    # Values that cannot be hashed keep their tables from being shared.
+    p2.loadDict({'b': {'c': LuaTable([1])}, 'd': {'c': LuaTable([1])}, 'e': [frozenset()], \
+        'f': {'x': set([1])}, 'g': {'x': set([1])}}, dedup = True)
+    if(p2['b']['c'] != {1: 1} or p2._dict['f'] is p2._dict['g'] or p2['g']['x'] != set([1])):
+        raise Exception('Dedup Error! Unhashable values.')
+
+def testParallel(f):
+    p1 = PyLuaTblParser()
+    p2 = PyLuaTblParser()
+    lines = []
+    infile = open(f)
+    for line in infile:
+        line = line.strip()
+        if(len(line) == 0 or line[0] == '#'):
+            continue
+        try:
+            p1.load(line)
+        except LuaParseError:
+            try:
+                p2.load(line, workers = 2)
+            except LuaParseError:
+                continue
+            print 'input : ' + line
+            raise Exception('Parallel Error! No error thrown.')
+        lines.append(line)
+        for workers in [1, 2]:
+            p2.load(line, workers = workers)
+            if(p2.dumpDict() != p1.dumpDict()):
+                print 'input : ' + line
+                raise Exception('Parallel Error!')
+    infile.close()
+    # Enough subtables for every worker to get several batches.
+    text = '{' + ', '.join([line for line in lines if line[:1] == '{'] * 4) + ', nil, x = 1}'
+    p1.load(text)
+    for workers in [1, 3]:
+        p2.load(text, workers = workers)
+        if(p2.dumpDict() != p1.dumpDict()):
+            raise Exception('Parallel Error!')
+    try:
+        p2.load(text[:-1] + ', {1 2}}', workers = 3)
+    except LuaParseError:
+        pass
+    else:
+        raise Exception('Parallel Error! No error thrown.')
+    # What a load could not honour is refused instead of ignored.
+    for arguments in [{'workers': 0}, {'workers': 2, 'arrays': True}, \
+        {'workers': 2, 'intern_strings': StringPool()}, {'workers': 1, 'lua_tables': True}, \
+        {'workers': 2, 'dedup': True}, {'workers': 2, 'lazy': True}, {'lazy': True, 'arrays': True}, \
+        {'editable': True, 'intern_strings': True}, {'select': ['a'], 'lua_tables': True}, \
+        {'select': ['a'], 'editable': True}, {'lua_tables': True, 'dedup': True}]:
+        try:
+            p2.load('{a = {1}}', **arguments)
+        except ValueError:
+            continue
+        print 'arguments : ', arguments
+        raise Exception('Parallel Error! No error for arguments.')
+    for workers in [0, -1]:
+        try:
+            load_many([], workers)
+        except ValueError:
+            continue
+        raise Exception('Parallel Error! No error for workers.')
+
 def testNilKey():
     p1 = PyLuaTblParser()
     p1.loadLuaTable('test_dump.lua')
@@ -65,6 +978,29 @@ def testNilKey():
 def test():
     #testNilKey()
     testfile('test.txt')
+    testIterparse('test4.txt')
+    testLazy('test4.txt')
+    testBufferInput('test4.txt')
+    testDumpStrings()
+    testDeepNesting()
+    testDumpStream('test4.txt')
+    testSnapshot('test4.txt')
+    testTokenize('test4.txt')
+    testLoadMany('test4.txt')
+    testParseCache('test4.txt')
+    testBinary('test4.txt')
+    testEdit('test4.txt')
+    testDiff('test4.txt')
+    testSelect('test4.txt')
+    testIterload('test4.txt')
+    testFeed('test4.txt')
+    testInstrument('test4.txt')
+    testArrays('test4.txt')
+    testInternStrings('test4.txt')
+    testLuaTables('test4.txt')
+    testMerge('test4.txt')
+    testDedup('test4.txt')
+    testParallel('test4.txt')
     '''
     #parser.update({'test':4, 'invalid':{(1, 2):100, 'valid': 48}})
     print parser.dumpDict()